@@ -169,11 +169,16 @@ def refresh(ctx, cmhost: str, tokenlocation: str, projectid: str, projectname: s
         if tokenlocation is None:
             tokenlocation = os.getenv(Constants.FABRIC_TOKEN_LOCATION)
 
-        slice_manager = __get_slice_manager(cm_host=cmhost, project_id=projectid, scope=scope,
-                                            token_location=tokenlocation, project_name=projectname)
-
-        click.echo(f"ID Token: {slice_manager.get_id_token()}")
-        click.echo(f"Refresh Token: {slice_manager.get_refresh_token()}")
+        with __get_slice_manager(cm_host=cmhost, project_id=projectid, scope=scope,
+                                 token_location=tokenlocation, project_name=projectname) as slice_manager:
+            # Loading the tokens skips the refresh when the stored token is still fresh; refresh explicitly
+            refresh_token = slice_manager.get_refresh_token()
+            if refresh_token is None:
+                raise click.ClickException(f"No refresh token found at: {tokenlocation}")
+            id_token, refresh_token = slice_manager.refresh_tokens(refresh_token=refresh_token)
+
+        click.echo(f"ID Token: {id_token}")
+        click.echo(f"Refresh Token: {refresh_token}")
         click.echo(f"Refreshed token saved at: {tokenlocation}")
     except click.ClickException as e:
         raise e
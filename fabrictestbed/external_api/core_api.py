@@ -23,11 +23,54 @@
 #
 # Author Komal Thareja (kthare10@renci.org)
 import datetime
+import http.cookiejar
 import json
 import logging
+import os
+import threading
 from typing import List
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+from fabrictestbed.util.utils import Utils
+
+# Retry idempotent requests on transient gateway errors
+_RETRY_POLICY = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False)
+
+# Session shared by all Core API clients, so connections to the Core API are kept alive across requests and clients;
+# clients may act for different users, so the session keeps no cookies
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """
+    Get the shared session; created on first use
+    @return session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            session.mount("https://", HTTPAdapter(pool_maxsize=4, max_retries=_RETRY_POLICY))
+            _session = session
+        return _session
+
+
+def _reset_session():
+    """
+    Forget the session inherited by a forked child so that it does not share connections with its parent
+    """
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_session)
 
 
 class CoreApiError(Exception):
@@ -54,6 +97,19 @@ class CoreApi:
             'Content-Type': 'application/json'
         }
 
+    @staticmethod
+    def __parse_response(response: requests.Response) -> dict:
+        """
+        Check the status of a Core API response and parse its body; the body is parsed once per response
+        @param response response
+        @return parsed response body
+        @raises CoreApiError if the request failed
+        """
+        if response.status_code != 200:
+            raise CoreApiError(f"Core API error occurred status_code: {response.status_code} "
+                               f"message: {response.content}")
+        return Utils.json_loads(response.content)
+
     def get_user_id(self) -> str:
         """
         Return User's uuid by querying via /whoami Core API
@@ -61,29 +117,25 @@ class CoreApi:
         @return User's uuid
         """
         url = f'{self.api_server}/whoami'
-        response = requests.get(url, headers=self.headers)
-        if response.status_code != 200:
-            raise CoreApiError(f"Core API error occurred status_code: {response.status_code} "
-                               f"message: {response.content}")
+        response = _get_session().get(url, headers=self.headers)
+        body = self.__parse_response(response)
 
-        logging.debug(f"GET WHOAMI Response : {response.json()}")
+        logging.debug("GET WHOAMI Response : %s", body)
 
-        return response.json().get("results")[0].get("uuid")
+        return body.get("results")[0].get("uuid")
 
     def get_user_info_by_email(self, *, email: str) -> dict:
         if email is None:
             raise CoreApiError("Core API error email must be specified!")
 
         url = f'{self.api_server}/people?search={email}&exact_match=true&offset=0&limit=5'
-        response = requests.get(url, headers=self.headers)
-        if response.status_code != 200:
-            raise CoreApiError(f"Core API error occurred status_code: {response.status_code} "
-                               f"message: {response.content}")
+        response = _get_session().get(url, headers=self.headers)
+        body = self.__parse_response(response)
 
-        logging.debug(f"GET PEOPLE Response : {response.json()}")
-        results = response.json().get("results")
+        logging.debug("GET PEOPLE Response : %s", body)
+        results = body.get("results")
         if len(results):
-            return response.json().get("results")[0]
+            return results[0]
 
     def get_user_info(self, *, uuid: str = None, email: str = None) -> dict:
         """
@@ -100,14 +152,12 @@ class CoreApi:
             uuid = self.get_user_id()
 
         url = f'{self.api_server}/people/{uuid}?as_self=true'
-        response = requests.get(url, headers=self.headers)
-        if response.status_code != 200:
-            raise CoreApiError(f"Core API error occurred status_code: {response.status_code} "
-                               f"message: {response.content}")
+        response = _get_session().get(url, headers=self.headers)
+        body = self.__parse_response(response)
 
-        logging.debug(f"GET WHOAMI Response : {response.json()}")
+        logging.debug("GET WHOAMI Response : %s", body)
 
-        return response.json().get("results")[0]
+        return body.get("results")[0]
 
     def __get_user_project_by_id(self, *, project_id: str) -> list:
         """
@@ -117,15 +167,13 @@ class CoreApi:
         @return list of the projects
         """
         url = f"{self.api_server}/projects/{project_id}"
-        response = requests.get(url, headers=self.headers)
+        response = _get_session().get(url, headers=self.headers)
 
-        if response.status_code != 200:
-            raise CoreApiError(f"Core API error occurred status_code: {response.status_code} "
-                               f"message: {response.content}")
+        body = self.__parse_response(response)
 
-        logging.debug(f"GET Project Response : {response.json()}")
+        logging.debug("GET Project Response : %s", body)
 
-        return response.json().get("results")
+        return body.get("results")
 
     def __get_user_projects(self, *, project_name: str = None, uuid: str = None) -> list:
         """
@@ -149,17 +197,15 @@ class CoreApi:
                 url = f"{self.api_server}/projects?offset={offset}&limit={limit}&person_uuid={uuid}" \
                       f"&sort_by=name&order_by=asc"
 
-            response = requests.get(url, headers=self.headers)
+            response = _get_session().get(url, headers=self.headers)
 
-            if response.status_code != 200:
-                raise CoreApiError(f"Core API error occurred status_code: {response.status_code} "
-                                   f"message: {response.content}")
+            body = self.__parse_response(response)
 
-            logging.debug(f"GET Project Response : {response.json()}")
+            logging.debug("GET Project Response : %s", body)
 
-            size = response.json().get("size")
-            total = response.json().get("total")
-            projects = response.json().get("results")
+            size = body.get("size")
+            total = body.get("total")
+            projects = body.get("results")
 
             total_fetched += size
 
@@ -244,13 +290,11 @@ class CoreApi:
             uuid = self.get_user_id()
 
         url = f'{self.api_server}/sshkeys?person_uuid={uuid}'
-        response = requests.get(url, headers=self.headers)
-        if response.status_code != 200:
-            raise CoreApiError(f"Core API error occurred status_code: {response.status_code} "
-                               f"message: {response.content}")
+        response = _get_session().get(url, headers=self.headers)
+        body = self.__parse_response(response)
 
-        logging.debug(f"GET SSH Keys Response : {response.json()}")
-        return response.json().get("results")
+        logging.debug("GET SSH Keys Response : %s", body)
+        return body.get("results")
 
     def create_ssh_keys(self, key_type: str, description: str,
                         comment: str = "ssh-key-via-api", store_pubkey: bool = True) -> list:
@@ -271,11 +315,9 @@ class CoreApi:
         }
 
         # Make a POST request to the core-api API
-        response = requests.post(f'{self.api_server}/sshkeys', headers=self.headers, data=json.dumps(data))
+        response = _get_session().post(f'{self.api_server}/sshkeys', headers=self.headers, data=json.dumps(data))
 
-        if response.status_code != 200:
-            raise CoreApiError(f"Core API error occurred status_code: {response.status_code} "
-                               f"message: {response.content}")
+        body = self.__parse_response(response)
 
-        logging.debug(f"POST SSH Keys Response : {response.json()}")
-        return response.json().get("results")
+        logging.debug("POST SSH Keys Response : %s", body)
+        return body.get("results")
@@ -23,12 +23,20 @@
 #
 #
 # Author: Komal Thareja (kthare10@renci.org)
+import enum
+import functools
+import inspect
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Tuple, Union, List, Dict
+from typing import Tuple, Union, List, Dict, Iterator
 
 from fabric_cf.orchestrator.swagger_client import Sliver, Slice
 from fabric_cf.orchestrator.swagger_client.models import PoaData
+from urllib3 import Retry
+from urllib3.util import make_headers
 
 from fabrictestbed.token_manager.token_manager import TokenManager
 from fabrictestbed.slice_editor import ExperimentTopology, AdvertisedTopology, GraphFormat
@@ -41,10 +49,159 @@ class SliceManagerException(Exception):
     """ Slice Manager Exception """
 
 
+class PoaOperation(str, enum.Enum):
+    """ POA operations supported by the orchestrator; members compare equal to their string values """
+    CPUINFO = "cpuinfo"
+    NUMAINFO = "numainfo"
+    CPUPIN = "cpupin"
+    NUMATUNE = "numatune"
+    REBOOT = "reboot"
+    ADDKEY = "addkey"
+    REMOVEKEY = "removekey"
+
+    def __str__(self):
+        return self.value
+
+
+# Idempotent requests are retried on connection errors and transient gateway failures; POSTs are never retried.
+# The final response is handed back to the swagger client so that errors still surface as ApiException.
+_RETRY_POLICY = Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False)
+
+# Connection pools shared by all Orchestrator Proxies talking to the same host, with the number of proxies using them
+_pool_managers = {}
+_pool_managers_lock = threading.Lock()
+
+
+def _reset_pool_managers():
+    """
+    Forget the connection pools inherited by a forked child so that it does not share sockets with its parent
+    """
+    global _pool_managers_lock
+    _pool_managers.clear()
+    _pool_managers_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool_managers)
+
+
+def _required(types: Union[type, Tuple[type, ...], None], message: str) -> tuple:
+    """
+    Validation rule for an argument that must be specified
+    @param types expected type(s); None to only check that the argument is specified
+    @param message error message returned if the argument is invalid
+    """
+    return types, True, message
+
+
+def _optional(types: Union[type, Tuple[type, ...]], message: str) -> tuple:
+    """
+    Validation rule for an argument that is type checked only when specified
+    @param types expected type(s)
+    @param message error message returned if the argument is invalid
+    """
+    return types, False, message
+
+
+def _validate(**rules):
+    """
+    Decorator validating the keyword arguments of a SliceManager API before invoking it
+    Rules are checked in the order specified; the first violation is returned as
+    (Status.INVALID_ARGUMENTS, SliceManagerException(message)) without invoking the API.
+    @param rules argument name mapped to a rule built with _required or _optional
+    """
+    def decorator(method):
+        parameters = inspect.signature(method).parameters
+        checks = tuple((name, types, required, message, parameters[name].default)
+                       for name, (types, required, message) in rules.items())
+
+        @functools.wraps(method)
+        def wrapper(self, **kwargs):
+            for name, types, required, message, default in checks:
+                value = kwargs.get(name, default)
+                if value is None:
+                    if required:
+                        return Status.INVALID_ARGUMENTS, SliceManagerException(message)
+                elif value is inspect.Parameter.empty:
+                    # Missing required argument; let the call raise TypeError
+                    break
+                # An exact type match short-circuits the isinstance MRO walk for the common case
+                elif types is not None and type(value) is not types and not isinstance(value, types):
+                    return Status.INVALID_ARGUMENTS, SliceManagerException(message)
+            return method(self, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _create_orchestrator_proxy(*, oc_host: str, max_connections: int) -> OrchestratorProxy:
+    """
+    Create an Orchestrator Proxy safe for use from concurrent threads
+    All APIs of the proxy share a single swagger ApiClient backed by a thread-safe urllib3 pool. The pool is shared
+    by every proxy created for the same host, so keep-alive connections (and their TLS sessions) survive across
+    SliceManager instances. On first use the pool is grown to at least max_connections, never shrunk below the size
+    the swagger client configured (five connections per CPU by default), so that concurrent callers reuse connections
+    instead of opening and discarding extra ones, and configured to retry transient failures. Responses are requested
+    compressed with every encoding urllib3 can decode, which shrinks the GraphML payloads considerably.
+    @param oc_host Orchestrator host
+    @param max_connections minimum number of connections kept alive to the orchestrator
+    @return Orchestrator Proxy
+    """
+    oc_proxy = OrchestratorProxy(orchestrator_host=oc_host)
+    api_client = oc_proxy.slices_api.api_client
+    for name, value in make_headers(accept_encoding=True).items():
+        api_client.set_default_header(name, value)
+    rest_client = api_client.rest_client
+    with _pool_managers_lock:
+        entry = _pool_managers.get(oc_host)
+        if entry is None:
+            pool_manager = rest_client.pool_manager
+            pool_kw = pool_manager.connection_pool_kw
+            pool_kw["maxsize"] = max(pool_kw.get("maxsize") or 1, max_connections)
+            pool_kw["retries"] = _RETRY_POLICY
+            entry = _pool_managers[oc_host] = [pool_manager, 0]
+        entry[1] += 1
+    rest_client.pool_manager = entry[0]
+    return oc_proxy
+
+
+def _release_orchestrator_proxy(*, oc_host: str, oc_proxy: OrchestratorProxy):
+    """
+    Release the resources held by an Orchestrator Proxy created by _create_orchestrator_proxy
+    The worker threads of its ApiClient are stopped; the shared connection pool for the host is closed once the
+    last proxy using it has been released.
+    @param oc_host Orchestrator host
+    @param oc_proxy Orchestrator Proxy
+    """
+    api_client = oc_proxy.slices_api.api_client
+    api_client.pool.close()
+    api_client.pool.join()
+    with _pool_managers_lock:
+        entry = _pool_managers.get(oc_host)
+        if entry is None or entry[0] is not api_client.rest_client.pool_manager:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del _pool_managers[oc_host]
+    entry[0].clear()
+
+
 class SliceManager(TokenManager):
     """
     Implements User facing Control Framework API interface
+    Use as a context manager, or call close(), to release its threads and connections deterministically:
+
+        with SliceManager(oc_host=oc_host, cm_host=cm_host, project_id=project_id) as slice_manager:
+            status, slices = slice_manager.slices()
     """
+    MAX_CONCURRENT_REQUESTS = 8
+    # Seconds for which resources() answers a repeated query from memory; 0 disables the cache. Set it on the class or
+    # an instance to opt in, e.g. to 60; the orchestrator itself refreshes its resource snapshot every 5 minutes
+    RESOURCES_CACHE_TTL = 0
+    RESOURCES_CACHE_SIZE = 16
+
     def __init__(self, *, cm_host: str = None, oc_host: str = None, token_location: str = None, project_id: str = None,
                  scope: str = "all", initialize: bool = True, project_name: str = None, auto_refresh: bool = True):
         super().__init__(cm_host=cm_host, token_location=token_location, project_id=project_id, scope=scope,
@@ -55,8 +212,59 @@ class SliceManager(TokenManager):
         if oc_host is None:
             raise SliceManagerException(f"Invalid initialization parameters: oc_host: {oc_host}")
 
-        self.oc_proxy = OrchestratorProxy(orchestrator_host=oc_host)
+        self._resources_cache = {}
+        self._resources_cache_lock = threading.Lock()
+        self._oc_host = oc_host
+        self.oc_proxy = _create_orchestrator_proxy(oc_host=oc_host, max_connections=self.MAX_CONCURRENT_REQUESTS)
+        self.start_refresh_timer()
+
+    def close(self):
+        """
+        Stop the background token refresh and release the orchestrator connections; safe to call more than once
+        """
+        super().close()
+        oc_host, self._oc_host = self._oc_host, None
+        if oc_host is not None:
+            _release_orchestrator_proxy(oc_host=oc_host, oc_proxy=self.oc_proxy)
+
+    def __getstate__(self):
+        """
+        Pickle support; the orchestrator proxy and cached resources are not pickled
+        """
+        state = super().__getstate__()
+        state.pop("oc_proxy", None)
+        state.pop("_resources_cache_lock", None)
+        state["_resources_cache"] = {}
+        return state
+
+    def __setstate__(self, state: dict):
+        """
+        Restore a pickled slice manager with a new orchestrator proxy, unless it had been closed
+        """
+        super().__setstate__(state)
+        self._resources_cache_lock = threading.Lock()
+        self.oc_proxy = None
+        if self._oc_host is not None:
+            self.oc_proxy = _create_orchestrator_proxy(oc_host=self._oc_host,
+                                                       max_connections=self.MAX_CONCURRENT_REQUESTS)
+
+    def _call(self, fn, **kwargs) -> Tuple[Status, Union[SliceManagerException, object]]:
+        """
+        Invoke an orchestrator proxy operation with a valid token, translating any exception into a failure tuple
+        @param fn orchestrator proxy operation
+        @param kwargs arguments for the operation
+        @return Tuple containing Status and Exception/result of the operation
+        """
+        try:
+            return fn(token=self.ensure_valid_token(), **kwargs)
+        except Exception as e:
+            return Status.FAILURE, SliceManagerException(Utils.extract_error_message(exception=e))
 
+    @_validate(slice_name=_required(str, "Invalid arguments - slice_name or ssh key"),
+               ssh_key=_required(None, "Invalid arguments - slice_name or ssh key"),
+               topology=_optional(ExperimentTopology, "Invalid arguments - topology"),
+               slice_graph=_optional(str, "Invalid arguments - slice_graph"),
+               lease_end_time=_optional(str, "Invalid arguments - lease_end_time"))
     def create(self, *, slice_name: str, ssh_key: Union[str, List[str]], topology: ExperimentTopology = None,
                slice_graph: str = None, lease_start_time: str = None, lease_end_time: str = None,
 	       lifetime: int = 24) -> Tuple[Status, Union[SliceManagerException, List[Sliver]]]:
@@ -71,26 +279,13 @@ class SliceManager(TokenManager):
         @param lifetime lifetime in hours
         @return Tuple containing Status and Exception/Json containing slivers created
         """
-        if slice_name is None or not isinstance(slice_name, str) or ssh_key is None:
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - slice_name or ssh key")
-
-        if topology is not None and not isinstance(topology, ExperimentTopology):
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - topology")
-
-        if slice_graph is not None and not isinstance(slice_graph, str):
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - slice_graph")
-
-        if lease_end_time is not None and not isinstance(lease_end_time, str):
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - lease_end_time")
-
-        try:
-            return self.oc_proxy.create(token=self.ensure_valid_token(), slice_name=slice_name, ssh_key=ssh_key,
-                                        topology=topology, slice_graph=slice_graph, lease_end_time=lease_end_time,
-                                        lease_start_time=lease_start_time, lifetime=lifetime)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+        return self._call(self.oc_proxy.create, slice_name=slice_name, ssh_key=ssh_key, topology=topology,
+                          slice_graph=slice_graph, lease_end_time=lease_end_time, lease_start_time=lease_start_time,
+                          lifetime=lifetime)
 
+    @_validate(slice_id=_required(str, "Invalid arguments - slice_id"),
+               topology=_optional(ExperimentTopology, "Invalid arguments - topology"),
+               slice_graph=_optional(str, "Invalid arguments - slice_graph"))
     def modify(self, *, slice_id: str, topology: ExperimentTopology = None,
                slice_graph: str = None) -> Tuple[Status, Union[SliceManagerException, List[Sliver]]]:
         """
@@ -100,38 +295,16 @@ class SliceManager(TokenManager):
         @param slice_graph Slice Graph string
         @return Tuple containing Status and Exception/Json containing slivers created
         """
-        if slice_id is None or not isinstance(slice_id, str):
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - slice_id")
-
-        if topology is not None and not isinstance(topology, ExperimentTopology):
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - topology")
-
-        if slice_graph is not None and not isinstance(slice_graph, str):
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid argument - slice_graph")
-
-        try:
-            return self.oc_proxy.modify(token=self.ensure_valid_token(), slice_id=slice_id, topology=topology,
-                                        slice_graph=slice_graph)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+        return self._call(self.oc_proxy.modify, slice_id=slice_id, topology=topology, slice_graph=slice_graph)
 
+    @_validate(slice_id=_required(str, "Invalid arguments - slice_id"))
     def modify_accept(self, *, slice_id: str) -> Tuple[Status, Union[SliceManagerException, ExperimentTopology]]:
         """
         Modify an existing slice
         @param slice_id slice id
         @return Tuple containing Status and Exception/Json containing slivers created
         """
-        if slice_id is None or not isinstance(slice_id, str):
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - slice_id")
-
-        try:
-            if self._should_renew():
-                self._load_tokens()
-            return self.oc_proxy.modify_accept(token=self.get_id_token(), slice_id=slice_id)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+        return self._call(self.oc_proxy.modify_accept, slice_id=slice_id)
 
     def delete(self, *, slice_object: Slice = None) -> Tuple[Status, Union[SliceManagerException, None]]:
         """
@@ -139,16 +312,44 @@ class SliceManager(TokenManager):
         @param slice_object slice to be deleted
         @return Tuple containing Status and Exception/Json containing deletion status
         """
-        try:
-            slice_id = slice_object.slice_id if slice_object is not None else None
-            return self.oc_proxy.delete(token=self.ensure_valid_token(), slice_id=slice_id)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+        slice_id = slice_object.slice_id if slice_object is not None else None
+        return self._call(self.oc_proxy.delete, slice_id=slice_id)
+
+    def delete_many(self, *, slices: List[Slice], max_workers: int = MAX_CONCURRENT_REQUESTS) -> \
+            List[Tuple[str, Status, Union[SliceManagerException, None]]]:
+        """
+        Delete multiple slices concurrently; each slice is deleted as by delete()
+        @param slices list of slices to be deleted
+        @param max_workers maximum number of delete requests in flight
+        @return List of tuples containing slice id, Status and Exception/None for each slice, in the order of slices;
+                a None entry is reported as invalid rather than passed on, as deleting without a slice id would
+                delete every slice
+        """
+        def delete_one(slice_object: Slice) -> Tuple[str, Status, Union[SliceManagerException, None]]:
+            if slice_object is None:
+                return None, Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - slice_object")
+            return (slice_object.slice_id, *self.delete(slice_object=slice_object))
+
+        return self._fan_out(delete_one, slices, max_workers=max_workers)
+
+    @staticmethod
+    def _fan_out(fn, items: list, *, max_workers: int) -> list:
+        """
+        Apply fn to every item using a bounded thread pool; results are returned in input order
+        @param fn callable invoked once per item
+        @param items items to process
+        @param max_workers maximum number of concurrent invocations
+        @return list of results
+        """
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            return list(executor.map(fn, items))
 
     def slices(self, includes: List[SliceState] = None, excludes: List[SliceState] = None, name: str = None,
                limit: int = 20, offset: int = 0, slice_id: str = None, as_self: bool = True,
-               graph_format: str = GraphFormat.GRAPHML.name) -> Tuple[Status, Union[SliceManagerException, List[Slice]]]:
+               graph_format: Union[GraphFormat, str] = GraphFormat.GRAPHML
+               ) -> Tuple[Status, Union[SliceManagerException, List[Slice]]]:
         """
         Get slices
         @param includes list of the slice state used to include the slices in the output
@@ -158,17 +359,30 @@ class SliceManager(TokenManager):
         @param offset offset of the first slice to return
         @param slice_id slice id
         @param as_self
-        @param graph_format
+        @param graph_format GraphFormat or its name
         @return Tuple containing Status and Exception/Json containing slices
         """
-        try:
-            return self.oc_proxy.slices(token=self.ensure_valid_token(), includes=includes, excludes=excludes,
-                                        name=name, limit=limit, offset=offset, slice_id=slice_id, as_self=as_self,
-                                        graph_format=graph_format)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+        if isinstance(graph_format, GraphFormat):
+            graph_format = graph_format.name
+        return self._call(self.oc_proxy.slices, includes=includes, excludes=excludes, name=name, limit=limit,
+                          offset=offset, slice_id=slice_id, as_self=as_self, graph_format=graph_format)
+
+    def iter_slices(self, *, includes: List[SliceState] = None, excludes: List[SliceState] = None, name: str = None,
+                    as_self: bool = True, page_size: int = 50) -> Iterator[Slice]:
+        """
+        Iterate over all slices matching the filters; the next page is fetched while the current one is consumed
+        @param includes list of the slice state used to include the slices in the output
+        @param excludes list of the slice state used to exclude the slices from the output
+        @param name name of the slice
+        @param as_self
+        @param page_size number of slices requested per page
+        @return iterator over slices
+        @raises SliceManagerException if a page cannot be retrieved
+        """
+        return self._iter_pages(functools.partial(self.slices, includes=includes, excludes=excludes, name=name,
+                                                  as_self=as_self), page_size=page_size)
 
+    @_validate(slice_object=_required(Slice, "Invalid arguments - slice_object"))
     def get_slice_topology(self, *, slice_object: Slice, graph_format: GraphFormat = GraphFormat.GRAPHML,
                            as_self: bool = True) -> Tuple[Status, Union[SliceManagerException, ExperimentTopology]]:
         """
@@ -178,15 +392,10 @@ class SliceManager(TokenManager):
         @param as_self
         @return Tuple containing Status and Exception/Json containing slice
         """
-        if slice_object is None or not isinstance(slice_object, Slice):
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - slice_object")
-        try:
-            return self.oc_proxy.get_slice(token=self.ensure_valid_token(), slice_id=slice_object.slice_id,
-                                           graph_format=graph_format, as_self=as_self)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+        return self._call(self.oc_proxy.get_slice, slice_id=slice_object.slice_id, graph_format=graph_format,
+                          as_self=as_self)
 
+    @_validate(slice_object=_required(Slice, "Invalid arguments - slice_object"))
     def slivers(self, *, slice_object: Slice,
                 as_self: bool = True) -> Tuple[Status, Union[SliceManagerException, List[Sliver]]]:
         """
@@ -195,36 +404,67 @@ class SliceManager(TokenManager):
         @param as_self
         @return Tuple containing Status and Exception/Json containing Sliver(s)
         """
-        if slice_object is None or not isinstance(slice_object, Slice):
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - slice_object")
+        return self._call(self.oc_proxy.slivers, slice_id=slice_object.slice_id, as_self=as_self)
 
-        try:
-            return self.oc_proxy.slivers(token=self.ensure_valid_token(), slice_id=slice_object.slice_id,
-                                         as_self=as_self)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+    def slivers_many(self, *, slice_objects: List[Slice], as_self: bool = True,
+                     max_workers: int = MAX_CONCURRENT_REQUESTS) -> List[Tuple[Status, Union[SliceManagerException,
+                                                                                              List[Sliver]]]]:
+        """
+        Get slivers for multiple slices concurrently; intended for callers polling several slices
+        @param slice_objects list of the slices
+        @param as_self
+        @param max_workers maximum number of requests in flight
+        @return List of tuples containing Status and Exception/Json containing Sliver(s), in the order of slice_objects
+        """
+        return self._fan_out(lambda s: self.slivers(slice_object=s, as_self=as_self), slice_objects,
+                             max_workers=max_workers)
 
     def resources(self, *, level: int = 1, force_refresh: bool = False, start: datetime = None, end: datetime = None,
-                  includes: List[str] = None,
-                  excludes: List[str] = None) -> Tuple[Status, Union[SliceManagerException, AdvertisedTopology]]:
+                  includes: List[str] = None, excludes: List[str] = None,
+                  use_cache: bool = True) -> Tuple[Status, Union[SliceManagerException, AdvertisedTopology]]:
         """
         Get resources
+        If RESOURCES_CACHE_TTL is set, results are cached for that many seconds per query, keeping the
+        RESOURCES_CACHE_SIZE most recently used queries; the cached topology is shared between callers and must not be
+        modified. The cache is disabled by default.
         @param level level
-        @param force_refresh force_refresh
+        @param force_refresh ask the orchestrator to refresh its resource snapshot; also bypasses the cache
+        @param use_cache answer from the cache if possible; pass False to query the orchestrator without forcing it to
+                         refresh its snapshot
         @param start start time
         @param end end time
         @param includes list of sites to include
         @param excludes list of sites to exclude
         @return Tuple containing Status and Exception/Json containing Resources
         """
-        try:
-            return self.oc_proxy.resources(token=self.ensure_valid_token(), level=level, force_refresh=force_refresh,
-                                           start=start, end=end, includes=includes, excludes=excludes)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+        ttl = self.RESOURCES_CACHE_TTL
+        key = level, start, end, tuple(includes) if includes else None, tuple(excludes) if excludes else None
+        if ttl > 0 and use_cache and not force_refresh:
+            with self._resources_cache_lock:
+                cached = self._resources_cache.pop(key, None)
+                if cached is not None and time.monotonic() - cached[0] < ttl:
+                    # Re-insert to mark the query as most recently used
+                    self._resources_cache[key] = cached
+                    return Status.OK, cached[1]
+        status, resources = self._call(self.oc_proxy.resources, level=level, force_refresh=force_refresh, start=start,
+                                       end=end, includes=includes, excludes=excludes)
+        if ttl > 0 and status == Status.OK:
+            with self._resources_cache_lock:
+                self._resources_cache.pop(key, None)
+                if len(self._resources_cache) >= self.RESOURCES_CACHE_SIZE:
+                    self._resources_cache.pop(next(iter(self._resources_cache)), None)
+                self._resources_cache[key] = time.monotonic(), resources
+        return status, resources
 
+    def clear_resources_cache(self):
+        """
+        Drop the cached resources so that the next query fetches them from the orchestrator
+        """
+        with self._resources_cache_lock:
+            self._resources_cache.clear()
+
+    @_validate(slice_object=_required(Slice, "Invalid arguments - slice_object or new_lease_end_time"),
+               new_lease_end_time=_required(None, "Invalid arguments - slice_object or new_lease_end_time"))
     def renew(self, *, slice_object: Slice,
               new_lease_end_time: str) -> Tuple[Status, Union[SliceManagerException, None]]:
         """
@@ -233,38 +473,28 @@ class SliceManager(TokenManager):
         @param new_lease_end_time new_lease_end_time
         @return Tuple containing Status and List of Reservation Id failed to extend
        """
-        if slice_object is None or not isinstance(slice_object, Slice) or new_lease_end_time is None:
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - "
-                                                                   "slice_object or new_lease_end_time")
-        try:
-            return self.oc_proxy.renew(token=self.ensure_valid_token(), slice_id=slice_object.slice_id,
-                                       new_lease_end_time=new_lease_end_time)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+        return self._call(self.oc_proxy.renew, slice_id=slice_object.slice_id, new_lease_end_time=new_lease_end_time)
 
-    def poa(self, *, sliver_id: str, operation: str, vcpu_cpu_map: List[Dict[str, str]] = None,
+    @_validate(sliver_id=_required(None, "Invalid arguments - sliver_id or operation"),
+               operation=_required(None, "Invalid arguments - sliver_id or operation"))
+    def poa(self, *, sliver_id: str, operation: Union[PoaOperation, str], vcpu_cpu_map: List[Dict[str, str]] = None,
             node_set: List[str] = None,
             keys: List[Dict[str, str]] = None) -> Tuple[Status, Union[SliceManagerException, List[PoaData]]]:
         """
         Issue POA for a sliver
         @param sliver_id sliver Id for which to trigger POA
-        @param operation operation
+        @param operation PoaOperation or its string value
         @param vcpu_cpu_map list of mappings from virtual CPU to physical cpu
         @param node_set list of the numa nodes
         @param keys list of keys to add/remove
         @return Tuple containing Status and POA information
        """
-        if sliver_id is None or operation is None:
-            return Status.INVALID_ARGUMENTS, SliceManagerException("Invalid arguments - sliver_id or operation")
-
         try:
-            return self.oc_proxy.poa(token=self.ensure_valid_token(), sliver_id=sliver_id, operation=operation,
-                                     vcpu_cpu_map=vcpu_cpu_map, node_set=node_set, keys=keys)
-
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+            operation = PoaOperation(operation).value
+        except ValueError:
+            return Status.INVALID_ARGUMENTS, SliceManagerException(f"Invalid arguments - operation: {operation}")
+        return self._call(self.oc_proxy.poa, sliver_id=sliver_id, operation=operation, vcpu_cpu_map=vcpu_cpu_map,
+                          node_set=node_set, keys=keys)
 
     def get_poas(self, sliver_id: str = None, poa_id: str = None, limit: int = 20,
                  offset: int = 0, ) -> Tuple[Status, Union[SliceManagerException, List[PoaData]]]:
@@ -276,9 +506,54 @@ class SliceManager(TokenManager):
         @param poa_id POA id identifying the POA
         @return Tuple containing Status and POA information
         """
-        try:
-            return self.oc_proxy.get_poas(token=self.ensure_valid_token(), limit=limit, offset=offset,
-                                          sliver_id=sliver_id, poa_id=poa_id)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, SliceManagerException(error_message)
+        return self._call(self.oc_proxy.get_poas, limit=limit, offset=offset, sliver_id=sliver_id, poa_id=poa_id)
+
+    def iter_poas(self, *, sliver_id: str, page_size: int = 50) -> Iterator[PoaData]:
+        """
+        Iterate over all POAs of a sliver; the next page is fetched while the current one is consumed
+        @param sliver_id sliver Id for which to retrieve POAs
+        @param page_size number of POAs requested per page
+        @return iterator over POAs
+        @raises SliceManagerException if a page cannot be retrieved
+        """
+        return self._iter_pages(functools.partial(self.get_poas, sliver_id=sliver_id), page_size=page_size)
+
+    @staticmethod
+    def _iter_pages(fetch, *, page_size: int) -> Iterator:
+        """
+        Yield the items of consecutive pages returned by fetch(limit=, offset=), prefetching one page ahead
+        Iteration stops at the first page holding fewer than page_size items
+        @param fetch callable returning a Tuple containing Status and Exception/List of items
+        @param page_size number of items requested per page
+        @return iterator over items
+        @raises SliceManagerException if a page cannot be retrieved
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            offset = 0
+            future = executor.submit(fetch, limit=page_size, offset=offset)
+            while future is not None:
+                status, page = future.result()
+                if status != Status.OK:
+                    if isinstance(page, SliceManagerException):
+                        raise page
+                    raise SliceManagerException(Utils.extract_error_message(exception=page))
+                page = page or []
+                future = None
+                if len(page) >= page_size:
+                    offset += page_size
+                    future = executor.submit(fetch, limit=page_size, offset=offset)
+                yield from page
+
+    def get_poas_many(self, *, sliver_ids: List[str] = None, poa_ids: List[str] = None,
+                      max_workers: int = MAX_CONCURRENT_REQUESTS) -> List[Tuple[Status, Union[SliceManagerException,
+                                                                                               List[PoaData]]]]:
+        """
+        Get POAs for multiple slivers and/or POA ids concurrently; intended for callers polling several POAs
+        @param sliver_ids list of sliver ids for which to retrieve POAs
+        @param poa_ids list of POA ids identifying the POAs
+        @param max_workers maximum number of requests in flight
+        @return List of tuples containing Status and POA information; sliver_ids results first, then poa_ids results,
+                each in the order requested
+        """
+        queries = [{"sliver_id": s} for s in sliver_ids or []] + [{"poa_id": p} for p in poa_ids or []]
+        return self._fan_out(lambda query: self.get_poas(**query), queries, max_workers=max_workers)
@@ -23,26 +23,115 @@
 #
 #
 # Author: Komal Thareja (kthare10@renci.org)
+import functools
 import json
 import logging
 import os
+import random
+import threading
+import time
+import weakref
 from abc import ABC
-from datetime import datetime, timezone, timedelta
-from typing import Tuple, List, Union, Any
+from datetime import datetime, timedelta, timezone
+from typing import Tuple, List, Union, Any, Optional
 
 from fabric_cm.credmgr.credmgr_proxy import CredmgrProxy, Status, TokenType
-from fabrictestbed.slice_manager import CmStatus
+from fabric_cm.credmgr.credmgr_proxy import Status as CmStatus
 
 from fabrictestbed.util.utils import Utils
 
 from fabrictestbed.util.constants import Constants
 
+logger = logging.getLogger(__name__)
+
+# Token dictionary keys, bound once as they are read on every request
+_ID_TOKEN_KEY = CredmgrProxy.ID_TOKEN
+_REFRESH_TOKEN_KEY = CredmgrProxy.REFRESH_TOKEN
+_CREATED_AT_KEY = CredmgrProxy.CREATED_AT
+
+# Validated identity token claims shared by all token managers in the process, keyed by (cm_host, id_token); entries
+# are dropped once the token expires or, oldest first, when the cache is full
+_ID_TOKEN_CLAIMS_CACHE_SIZE = 64
+_id_token_claims = {}
+_id_token_claims_lock = threading.Lock()
+
+
+def _store_id_token_claims(key: tuple, claims: dict):
+    """
+    Add validated identity token claims to the shared cache, evicting expired and, if full, the oldest entries
+    @param key tuple of the credential manager host and the identity token
+    @param claims validated claims
+    """
+    with _id_token_claims_lock:
+        now = time.time()
+        for cached_key in [k for k, v in _id_token_claims.items() if v.get("exp", 0) <= now]:
+            del _id_token_claims[cached_key]
+        if len(_id_token_claims) >= _ID_TOKEN_CLAIMS_CACHE_SIZE:
+            del _id_token_claims[next(iter(_id_token_claims))]
+        _id_token_claims[key] = claims
+
+
+def _reset_id_token_claims_lock():
+    """
+    Replace the cache lock in a forked child, where it may have been inherited in the locked state
+    """
+    global _id_token_claims_lock
+    _id_token_claims_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_id_token_claims_lock)
+
 
 class TokenManagerException(Exception):
     pass
 
 
+def _wrap_cm(method):
+    """
+    Decorator for Credential Manager APIs: any exception raised by the API is returned as
+    (Status.FAILURE, TokenManagerException(message))
+    @param method API to wrap
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except Exception as e:
+            return Status.FAILURE, TokenManagerException(Utils.extract_error_message(exception=e))
+
+    return wrapper
+
+
+def _refresh_in_background(token_manager_ref: weakref.ref):
+    """
+    Background refresh timer callback; holds only a weak reference so that the timer does not keep the
+    token manager alive
+    @param token_manager_ref weak reference to the token manager
+    """
+    token_manager = token_manager_ref()
+    if token_manager is not None:
+        token_manager._refresh_in_background()
+
+
 class TokenManager(ABC):
+    # Fraction of the identity token lifetime, at the end, during which the renewal policy is re-evaluated
+    REFRESH_WINDOW = 0.25
+    # Minimum interval in seconds between background refresh attempts
+    REFRESH_RETRY_INTERVAL = 60
+    # Upper bound in seconds of the random per-instance delay added to background refresh attempts, so that token
+    # managers sharing a token do not all attempt to refresh it at the same moment
+    REFRESH_TIMER_JITTER = 300
+    # Tokens are renewed once they are this old, less a random per-instance jitter so that sessions created together
+    # do not all renew at the same moment
+    RENEW_AFTER = timedelta(minutes=180)
+    RENEW_JITTER = timedelta(minutes=15)
+    # Seconds to wait before re-reading a token file that could not be parsed
+    TOKEN_FILE_RETRY_DELAY = 0.05
+    # Minimum interval in seconds between refreshes with the same refresh token; repeated requests within it are
+    # answered with the tokens just obtained
+    MIN_REFRESH_INTERVAL = 5
+
     def __init__(self, *, cm_host: str = None, token_location: str = None, project_id: str = None, scope: str = "all",
                  project_name: str = None, auto_refresh: bool = True, initialize: bool = True):
         """
@@ -69,28 +158,45 @@ class TokenManager(ABC):
         @return: None
         """
 
+        # Defaults are read from the environment at construction time, as notebooks may set it after import
+        environ = os.environ
         self.auto_refresh = auto_refresh
-        self.logger = logging.getLogger()
+        self.logger = logger
         self.initialized = False
         if cm_host is None:
-            cm_host = os.environ.get(Constants.FABRIC_CREDMGR_HOST)
-        self.cm_proxy = CredmgrProxy(credmgr_host=cm_host)
+            cm_host = environ.get(Constants.FABRIC_CREDMGR_HOST)
+        self._cm_host = cm_host
+        self._cm_proxy = None
         self.token_location = token_location
         self.tokens = {}
+        self._id_token_times = (None, None, None, 0)
+        self._created_at = (None, None)
+        self._id_token_hash = (None, None)
+        self._renew_after = (self.RENEW_AFTER - self.RENEW_JITTER * random.random()).total_seconds()
+        self._refresh_timer_offset = self.REFRESH_TIMER_JITTER * random.random()
+        self._refresh_lock = threading.Lock()
+        self._refresh_timer = None
+        self._closed = False
+        self._last_refresh = None
         self.project_id = project_id
         if self.project_id is None:
-            self.project_id = os.environ.get(Constants.FABRIC_PROJECT_ID)
+            self.project_id = environ.get(Constants.FABRIC_PROJECT_ID)
         self.project_name = project_name
         if self.project_name is None:
-            self.project_name = os.environ.get(Constants.FABRIC_PROJECT_NAME)
+            self.project_name = environ.get(Constants.FABRIC_PROJECT_NAME)
         self.scope = scope
         if self.token_location is None:
-            self.token_location = os.environ.get(Constants.FABRIC_TOKEN_LOCATION)
+            self.token_location = environ.get(Constants.FABRIC_TOKEN_LOCATION)
 
         if cm_host is None or self.token_location is None:
             raise TokenManagerException(f"Invalid initialization parameters: cm_host: {cm_host}, "
                                         f"token_location: {self.token_location}")
 
+        self.user_id = None
+        self.user_email = None
+        # Set when the user information was read from the identity token rather than passed in
+        self._user_info_from_token = False
+
         # Try to load the project_id or project_name from the Token
         if project_id is None and project_name is None:
             self._extract_project_and_user_info_from_token(cm_host=cm_host)
@@ -100,12 +206,23 @@ class TokenManager(ABC):
             raise TokenManagerException(f"Invalid initialization parameters: project_id={self.project_id}, "
                                         f"project_name={self.project_name}")
 
-        self.user_id = None
-        self.user_email = None
-
         if initialize:
             self.initialize()
 
+    @property
+    def cm_proxy(self) -> CredmgrProxy:
+        """
+        Credential Manager Proxy; created on first use so that token-only callers do not pay for its API client
+        @return Credential Manager Proxy
+        """
+        if self._cm_proxy is None:
+            self._cm_proxy = CredmgrProxy(credmgr_host=self._cm_host)
+        return self._cm_proxy
+
+    @cm_proxy.setter
+    def cm_proxy(self, cm_proxy: CredmgrProxy):
+        self._cm_proxy = cm_proxy
+
     def initialize(self):
         """
         Initialize the Slice Manager object
@@ -129,14 +246,14 @@ class TokenManager(ABC):
         Get Refresh Token
         @return refresh token
         """
-        return self.tokens.get(CredmgrProxy.REFRESH_TOKEN, None)
+        return self.tokens.get(_REFRESH_TOKEN_KEY)
 
     def get_id_token(self) -> str:
         """
         Get Id token
         @return id token
         """
-        return self.tokens.get(CredmgrProxy.ID_TOKEN, None)
+        return self.tokens.get(_ID_TOKEN_KEY)
 
     def set_token_location(self, *, token_location: str):
         """
@@ -160,53 +277,132 @@ class TokenManager(ABC):
               instance variables `project_id`, `project_name`, `user_id`, and `user_email`.
         """
         self._load_tokens(refresh=False)
-        if self.get_id_token() is not None:
-            logging.info("Project Id/Name not specified, trying to determine it from the token")
-            decoded_token = Utils.decode_token(cm_host=cm_host, token=self.get_id_token())
-            if decoded_token.get("projects") and len(decoded_token.get("projects")):
-                self.project_id = decoded_token.get("projects")[0].get("uuid")
-                self.project_name = decoded_token.get("projects")[0].get("name")
+        id_token = self.get_id_token()
+        if id_token is not None:
+            logger.info("Project Id/Name not specified, trying to determine it from the token")
+            decoded_token = self._get_id_token_claims(cm_host=cm_host, id_token=id_token)
+            # Seed the token times from the claims just decoded rather than decoding the token again later
+            self._get_id_token_times(id_token, claims=decoded_token)
+            projects = decoded_token.get("projects")
+            if projects:
+                project = projects[0]
+                self.project_id = project.get("uuid")
+                self.project_name = project.get("name")
             self.user_id = decoded_token.get("uuid")
             self.user_email = decoded_token.get("email")
+            self._user_info_from_token = True
 
-    def _load_tokens(self, refresh: bool = True):
+    def _get_id_token_claims(self, *, cm_host: str, id_token: str) -> dict:
+        """
+        Get the validated claims of the identity token
+        The claims are cached per token until it expires and shared by all token managers in the process, so the
+        signature is verified once per token rather than on every lookup
+        @param cm_host credential manager host used to validate the token
+        @param id_token identity token
+        @return decoded claims
+        @raises Exception if the token cannot be validated
+        """
+        key = cm_host, id_token
+        with _id_token_claims_lock:
+            claims = _id_token_claims.get(key)
+        if claims is not None and time.time() < claims.get("exp", 0):
+            return claims
+
+        claims = Utils.decode_token(cm_host=cm_host, token=id_token)
+        _store_id_token_claims(key, claims)
+        return claims
+
+    def _load_tokens(self, refresh: bool = True, only_if_due: bool = False):
         """
         Load Fabric Tokens from the tokens.json if it exists
         Otherwise, this is the first attempt, create the tokens and save them
+        @param refresh refresh the tokens after loading them
+        @param only_if_due refresh only if the loaded tokens are still due for renewal, i.e. they have not already
+        been renewed by another process sharing the token file
         @note this function is invoked when reloading the tokens to ensure tokens
         from the token file are read instead of the local variables
         """
         # Load the tokens from the JSON
-        if os.path.exists(self.token_location):
-            with open(self.token_location, 'r') as stream:
-                self.tokens = json.loads(stream.read())
+        try:
+            self.tokens = self._read_token_file()
             refresh_token = self.get_refresh_token()
-        else:
+        except FileNotFoundError:
             # First time login, use environment variable to load the tokens
             refresh_token = os.environ.get(Constants.CILOGON_REFRESH_TOKEN)
-        # Renew the tokens to ensure any project_id changes are taken into account
-        if refresh and self.auto_refresh and refresh_token:
+        # Renew the tokens to ensure any project_id changes are taken into account, unless the loaded identity token
+        # is fresh and already issued for this project and scope
+        if refresh and self.auto_refresh and refresh_token and (not only_if_due or self._should_renew()) and \
+                not self._id_token_matches_session():
             self.refresh_tokens(refresh_token=refresh_token)
 
+    def _id_token_matches_session(self) -> bool:
+        """
+        Check if the current identity token is fresh and was issued for the project and scope of this token manager,
+        i.e. refreshing it would only return an equivalent token
+        @return true if the identity token can be used as is; false otherwise
+        """
+        id_token = self.get_id_token()
+        if id_token is None or time.time() >= self._get_id_token_deadline(id_token):
+            return False
+        try:
+            claims = Utils.get_unverified_claims(token=id_token)
+        except ValueError:
+            return False
+        if claims.get("scope", self.scope) != self.scope:
+            return False
+        for project in claims.get("projects") or []:
+            if self.project_id is not None:
+                if project.get("uuid") == self.project_id:
+                    return True
+            elif self.project_name is not None and project.get("name") == self.project_name:
+                return True
+        return False
+
+    def _read_token_file(self) -> dict:
+        """
+        Read the tokens from the token file
+        CredmgrProxy replaces the file atomically, but other tools sharing the file may not; a file caught mid-write
+        is read once more after a short pause.
+        @return tokens
+        @raises FileNotFoundError if the token file does not exist
+        """
+        with open(self.token_location, 'rb', buffering=0) as stream:
+            data = stream.read()
+        try:
+            return Utils.json_loads(data)
+        except json.JSONDecodeError:
+            time.sleep(self.TOKEN_FILE_RETRY_DELAY)
+            with open(self.token_location, 'rb', buffering=0) as stream:
+                return Utils.json_loads(stream.read())
+
     def _should_renew(self) -> bool:
         """
         Check if tokens should be renewed
-        Returns true if tokens are at least 30 minutes old
+        Returns true if tokens are at least RENEW_AFTER (less this instance's jitter) old
         @return true if tokens should be renewed; false otherwise
         """
         self._check_initialized()
 
-        id_token = self.get_id_token()
-        created_at = self.tokens.get(CredmgrProxy.CREATED_AT, None)
+        if self.get_id_token() is None:
+            return True
 
-        created_at_time = datetime.strptime(created_at, CredmgrProxy.TIME_FORMAT)
-        now = datetime.now(timezone.utc)
+        created_at = self.tokens.get(_CREATED_AT_KEY)
 
-        if id_token is None or now - created_at_time >= timedelta(minutes=180):
-            return True
+        # Parse the creation time once per token set and compare as seconds since epoch
+        cached_created_at, created_at_epoch = self._created_at
+        if created_at_epoch is None or cached_created_at != created_at:
+            try:
+                created_at_epoch = Utils.parse_time(created_at, CredmgrProxy.TIME_FORMAT).timestamp()
+            except (ValueError, TypeError):
+                # Fall back to the issue time of the identity token; the result is cached like a parsed value so
+                # an unparseable field is not parsed again on every check
+                logger.debug("Unable to parse created_at %r, using the identity token issue time", created_at)
+                created_at_epoch = self._get_id_token_times(self.get_id_token())[0] or 0
+            self._created_at = (created_at, created_at_epoch)
 
-        return False
+        return time.time() - created_at_epoch >= self._renew_after
 
+    @_wrap_cm
     def create_token(self, scope: str = "all", project_id: str = None, project_name: str = None, file_name: str = None,
                      life_time_in_hours: int = 4, comment: str = "Created via API",
                      browser_name: str = "chrome") -> Tuple[Status, Union[dict, TokenManagerException]]:
@@ -222,13 +418,9 @@ class TokenManager(ABC):
         @returns Tuple of Status, token json or Exception
         @raises Exception in case of failure
         """
-        try:
-            return self.cm_proxy.create(scope=scope, project_id=project_id, project_name=project_name,
-                                        file_name=file_name, life_time_in_hours=life_time_in_hours, comment=comment,
-                                        browser_name=browser_name)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, TokenManagerException(error_message)
+        return self.cm_proxy.create(scope=scope, project_id=project_id, project_name=project_name,
+                                    file_name=file_name, life_time_in_hours=life_time_in_hours, comment=comment,
+                                    browser_name=browser_name)
 
     def refresh_tokens(self, *, refresh_token: str) -> Tuple[str, str]:
         """
@@ -239,13 +431,28 @@ class TokenManager(ABC):
         @note this exposes an API for the user to refresh tokens explicitly only. CredMgrProxy::refresh already
         updates the refresh tokens to the token file atomically.
         """
+        # Refresh tokens are rotated, so both the token used and the one returned identify the last refresh; the
+        # tokens are only reused if they were issued for the same project and scope
+        session = self.project_id, self.project_name, self.scope
+        if self._last_refresh is not None and self.get_id_token() is not None:
+            last_session, used, received, refreshed_at = self._last_refresh
+            if last_session == session and refresh_token in (used, received) and \
+                    time.monotonic() - refreshed_at < self.MIN_REFRESH_INTERVAL:
+                return self.get_id_token(), self.get_refresh_token()
+
         try:
             status, tokens = self.cm_proxy.refresh(project_id=self.project_id, scope=self.scope,
                                                    refresh_token=refresh_token, file_name=self.token_location,
                                                    project_name=self.project_name)
             if status == CmStatus.OK:
                 self.tokens = tokens
-                return tokens.get(CredmgrProxy.ID_TOKEN, None), tokens.get(CredmgrProxy.REFRESH_TOKEN, None)
+                self._last_refresh = (session, refresh_token, tokens.get(_REFRESH_TOKEN_KEY), time.monotonic())
+                if self._user_info_from_token:
+                    # The refreshed token may carry different claims; re-read them on next use. The project is
+                    # kept as the token was refreshed for it.
+                    self.user_id = self.user_email = None
+                    self._user_info_from_token = False
+                return tokens.get(_ID_TOKEN_KEY), tokens.get(_REFRESH_TOKEN_KEY)
             else:
                 error_message = Utils.extract_error_message(exception=tokens)
                 raise TokenManagerException(error_message)
@@ -253,6 +460,7 @@ class TokenManager(ABC):
             error_message = Utils.extract_error_message(exception=e)
             raise TokenManagerException(error_message)
 
+    @_wrap_cm
     def revoke_token(self, *, refresh_token: str = None, id_token: str = None, token_hash: str = None,
                      token_type: TokenType = TokenType.Refresh) -> Tuple[Status, Any]:
         """
@@ -268,26 +476,22 @@ class TokenManager(ABC):
         if id_token is None:
             id_token = self.get_id_token()
         if token_hash is None:
-            token_hash = Utils.generate_sha256(token=id_token)
+            cached_token, token_hash = self._id_token_hash
+            if cached_token is not id_token:
+                token_hash = Utils.generate_sha256(token=id_token)
+                self._id_token_hash = (id_token, token_hash)
 
-        try:
-            return self.cm_proxy.revoke(refresh_token=refresh_token, identity_token=id_token, token_hash=token_hash,
-                                        token_type=token_type)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, TokenManagerException(error_message)
+        return self.cm_proxy.revoke(refresh_token=refresh_token, identity_token=id_token, token_hash=token_hash,
+                                    token_type=token_type)
 
+    @_wrap_cm
     def token_revoke_list(self, *, project_id: str) -> Tuple[Status, Union[TokenManagerException, List[str]]]:
         """
         Get Token Revoke list for a project
         @param project_id project_id
         @return token revoke list
         """
-        try:
-            return self.cm_proxy.token_revoke_list(project_id=project_id)
-        except Exception as e:
-            error_message = Utils.extract_error_message(exception=e)
-            return Status.FAILURE, TokenManagerException(error_message)
+        return self.cm_proxy.token_revoke_list(project_id=project_id)
 
     def clear_token_cache(self, *, file_name: str = None):
         """
@@ -303,14 +507,173 @@ class TokenManager(ABC):
             return Status.OK, None
         return Status.FAILURE, f"Failed to clear token cache: {Utils.extract_error_message(exception=exception)}"
 
+    def _get_id_token_times(self, id_token: str,
+                            claims: dict = None) -> Tuple[Optional[float], Optional[float], float]:
+        """
+        Get the issue time, expiry time and renewal deadline of the identity token
+        The times are read from the (unverified) iat/exp claims and cached per token, so the token is decoded once
+        @param id_token identity token
+        @param claims claims of id_token if already decoded
+        @return tuple of issue time and expiry time as seconds since epoch (None if absent), and the time until
+        which the token can be used without evaluating the renewal policy (0 if it cannot be determined)
+        """
+        times = self._id_token_times
+        if times[0] is not id_token:
+            issued_at = expires_at = None
+            deadline = 0
+            try:
+                if claims is None:
+                    claims = Utils.get_unverified_claims(token=id_token)
+                issued_at, expires_at = claims.get("iat"), claims.get("exp")
+                if issued_at and expires_at:
+                    deadline = expires_at - (expires_at - issued_at) * self.REFRESH_WINDOW
+            except (KeyError, TypeError, ValueError):
+                # Treat a token with malformed iat/exp claims as one whose times cannot be determined
+                issued_at = expires_at = None
+                deadline = 0
+            times = self._id_token_times = (id_token, issued_at, expires_at, deadline)
+        return times[1:]
+
+    def _get_id_token_deadline(self, id_token: str) -> float:
+        """
+        Get the time until which the identity token can be used without evaluating the renewal policy
+        @param id_token identity token
+        @return deadline as seconds since epoch; 0 if it cannot be determined
+        """
+        return self._get_id_token_times(id_token)[2]
+
+    def id_token_issued_at(self) -> Optional[datetime]:
+        """
+        Get the time the current identity token was issued at; computed once per token
+        @return issue time in UTC; None if there is no token or it carries no iat claim
+        """
+        id_token = self.get_id_token()
+        issued_at = self._get_id_token_times(id_token)[0] if id_token is not None else None
+        return datetime.fromtimestamp(issued_at, timezone.utc) if issued_at else None
+
+    def id_token_expires_at(self) -> Optional[datetime]:
+        """
+        Get the time the current identity token expires at; computed once per token
+        @return expiry time in UTC; None if there is no token or it carries no exp claim
+        """
+        id_token = self.get_id_token()
+        expires_at = self._get_id_token_times(id_token)[1] if id_token is not None else None
+        return datetime.fromtimestamp(expires_at, timezone.utc) if expires_at else None
+
     def ensure_valid_token(self) -> str:
         """
         Ensures the token is valid and renews it if required.
         @return valid identity token
         """
-        if self._should_renew():
-            self._load_tokens()
-        return self.get_id_token()
+        self._check_initialized()
+        id_token = self.get_id_token()
+        if id_token is not None and time.time() < self._get_id_token_deadline(id_token):
+            return id_token
+
+        # Only one thread renews the tokens; the others wait and pick up the renewed token
+        with self._refresh_lock:
+            id_token = self.get_id_token()
+            if id_token is not None and time.time() < self._get_id_token_deadline(id_token):
+                return id_token
+            if self._should_renew():
+                self._load_tokens(only_if_due=True)
+            return self.get_id_token()
+
+    def start_refresh_timer(self, *, delay: float = None):
+        """
+        Renew the tokens in a background thread shortly before they are due, keeping the renewal off the request
+        path. The timer re-arms itself after every attempt until close() is called. A random per-instance offset is
+        added to the delay, and the attempt renews only if the renewal policy says the tokens are due and they were not
+        already renewed through the token file, so token managers sharing a token do not renew it all at once.
+        @param delay seconds until the next renewal attempt; derived from the identity token if not specified
+        """
+        if not self.auto_refresh or not self.initialized:
+            return
+        if delay is None:
+            id_token = self.get_id_token()
+            deadline = self._get_id_token_deadline(id_token) if id_token is not None else 0
+            if not deadline:
+                return
+            delay = deadline - time.time()
+        delay = max(delay, self.REFRESH_RETRY_INTERVAL) + self._refresh_timer_offset
+
+        with self._refresh_lock:
+            if self._closed:
+                return
+            self._cancel_refresh_timer()
+            timer = threading.Timer(delay, _refresh_in_background, args=(weakref.ref(self),))
+            timer.daemon = True
+            timer.start()
+            # Cancel the timer if this token manager is garbage collected without being closed
+            self._refresh_timer = timer, weakref.finalize(self, timer.cancel)
+
+    def _cancel_refresh_timer(self):
+        """
+        Cancel the background refresh timer; caller must hold the refresh lock
+        """
+        if self._refresh_timer is not None:
+            timer, finalizer = self._refresh_timer
+            finalizer()
+            self._refresh_timer = None
+
+    def _refresh_in_background(self):
+        """
+        Renew the tokens if they are due and re-arm the background refresh timer
+        """
+        with self._refresh_lock:
+            self._refresh_timer = None
+            if self._closed:
+                return
+            id_token = self.get_id_token()
+            if id_token is None or time.time() >= self._get_id_token_deadline(id_token):
+                try:
+                    self._load_tokens(only_if_due=True)
+                except Exception as e:
+                    logger.warning("Background token refresh failed: %s", e)
+        self.start_refresh_timer()
+
+    def close(self):
+        """
+        Stop the background token refresh, if running; it is not restarted afterwards, even by a refresh attempt
+        that is already in progress
+        """
+        with self._refresh_lock:
+            self._closed = True
+            self._cancel_refresh_timer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getstate__(self):
+        """
+        Pickle support, e.g. for handing a token manager to worker processes
+        Locks, the refresh timer and API clients are not pickled; the validated claims of the current identity token
+        are carried along so that workers do not validate the token again
+        """
+        state = self.__dict__.copy()
+        for name in ("_refresh_lock", "_refresh_timer", "_cm_proxy", "_last_refresh"):
+            state.pop(name, None)
+        with _id_token_claims_lock:
+            state["_id_token_claims"] = _id_token_claims.get((self._cm_host, self.get_id_token()))
+        return state
+
+    def __setstate__(self, state: dict):
+        """
+        Restore a pickled token manager; the background refresh is not restarted, call start_refresh_timer() if
+        required. A token manager pickled after close() stays closed.
+        """
+        claims = state.pop("_id_token_claims", None)
+        self.__dict__.update(state)
+        self._refresh_lock = threading.Lock()
+        self._refresh_timer = None
+        self.__dict__.setdefault("_closed", False)
+        self._cm_proxy = None
+        self._last_refresh = None
+        if claims is not None and time.time() < claims.get("exp", 0):
+            _store_id_token_claims((self._cm_host, self.get_id_token()), claims)
 
     def get_user_id(self) -> str:
         """
@@ -322,9 +685,7 @@ class TokenManager(ABC):
 
         @return: The user ID if available; otherwise, None.
         """
-        if not self.user_id and self.get_id_token() and self.cm_proxy:
-            self._extract_project_and_user_info_from_token(cm_host=self.cm_proxy.host)
-        return self.user_id
+        return self.get_user_id_and_email()[0]
 
     def get_user_email(self) -> str:
         """
@@ -336,9 +697,19 @@ class TokenManager(ABC):
 
         @return: The user email if available; otherwise, None.
         """
-        if not self.user_email and self.get_id_token() and self.cm_proxy:
-            self._extract_project_and_user_info_from_token(cm_host=self.cm_proxy.host)
-        return self.user_email
+        return self.get_user_id_and_email()[1]
+
+    def get_user_id_and_email(self) -> Tuple[str, str]:
+        """
+        Retrieve the user ID and email associated with the current session.
+
+        Both are extracted from the identity token together, so fetching both costs a single token decode.
+
+        @return: Tuple of the user ID and user email; either is None if not available.
+        """
+        if (not self.user_id or not self.user_email) and self.get_id_token() and self._cm_host:
+            self._extract_project_and_user_info_from_token(cm_host=self._cm_host)
+        return self.user_id, self.user_email
 
     def get_project_name(self) -> str:
         """
@@ -350,6 +721,6 @@ class TokenManager(ABC):
 
         @return: The project_name if available; otherwise, None.
         """
-        if not self.project_name and self.get_id_token() and self.cm_proxy:
-            self._extract_project_and_user_info_from_token(cm_host=self.cm_proxy.host)
+        if not self.project_name and self.get_id_token() and self._cm_host:
+            self._extract_project_and_user_info_from_token(cm_host=self._cm_host)
         return self.project_name
@@ -24,31 +24,86 @@
 #
 # Author: Komal Thareja (kthare10@renci.org)
 #
+import base64
 import hashlib
 import json
+import os
+import threading
+import time
 from datetime import datetime, timedelta
+from typing import Union
 
 from fss_utils.jwt_manager import ValidateCode
 from fss_utils.jwt_validate import JWTValidator
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JWT validators per credential manager host, with the time their keys were last refetched for an unknown key id and
+# the lock serializing validations for the host; each caches the signing keys of its host for JWKS_REFRESH_PERIOD
+_jwt_validators = {}
+_jwt_validators_lock = threading.Lock()
+
+
+def _reset_jwt_validators():
+    """
+    Forget the validators inherited by a forked child, whose locks may have been inherited in the locked state
+    """
+    global _jwt_validators_lock
+    _jwt_validators.clear()
+    _jwt_validators_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_jwt_validators)
+
 
 class Utils:
+    # Period for which the signing keys fetched from the credential manager are reused
+    JWKS_REFRESH_PERIOD = timedelta(minutes=10)
+    # Minimum interval in seconds between early key refetches triggered by tokens signed with an unknown key
+    JWKS_REFETCH_INTERVAL = 30
+
     @staticmethod
     def generate_sha256(*, token: str):
         """
         Generate SHA 256 for a token
         @param token token string
         """
-        # Create a new SHA256 hash object
-        sha256_hash = hashlib.sha256()
-
-        # Convert the string to bytes and update the hash object
-        sha256_hash.update(token.encode('utf-8'))
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
 
-        # Get the hexadecimal representation of the hash
-        sha256_hex = sha256_hash.hexdigest()
+    @staticmethod
+    def json_loads(data: Union[str, bytes]):
+        """
+        Parse a JSON document; uses orjson when it is installed and the standard library otherwise
+        @param data JSON document as str or bytes
+        @return parsed object
+        @raises json.JSONDecodeError if data is not valid JSON
+        """
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
 
-        return sha256_hex
+    @staticmethod
+    def parse_time(value: str, time_format: str) -> datetime:
+        """
+        Parse a timezone-aware timestamp such as "2024-01-01 10:00:00 +0000"
+        datetime.fromisoformat is tried first as it is much faster than strptime; it accepts this layout from
+        Python 3.11 onwards, older versions fall back to strptime
+        @param value timestamp string
+        @param time_format strptime format of the timestamp
+        @return timezone-aware datetime
+        @raises ValueError if value does not match time_format
+        """
+        try:
+            parsed = datetime.fromisoformat(value)
+            if parsed.tzinfo is not None:
+                return parsed
+        except ValueError:
+            pass
+        return datetime.strptime(value, time_format)
 
     @staticmethod
     def extract_error_message(*, exception):
@@ -63,7 +118,7 @@ class Utils:
         if response_body:
             try:
                 if not isinstance(response_body, dict):
-                    response_body = json.loads(response_body)
+                    response_body = Utils.json_loads(response_body)
                 errors = response_body.get("errors")
                 if errors and len(errors) > 0:
                     return f"{errors[0].get('message')} - {errors[0].get('details')}"
@@ -71,12 +126,65 @@ class Utils:
                 return str(exception)
         return str(exception)
 
+    @staticmethod
+    def get_unverified_claims(*, token: str) -> dict:
+        """
+        Read the claims of a JWT without validating it
+        Only suitable for local decisions such as estimating when a token expires; use decode_token whenever the
+        claims must be trusted
+        @param token JWT
+        @return claims
+        @raises ValueError if the token is malformed
+        """
+        # Slice out the payload rather than splitting, as the header and signature are not needed
+        start = token.find(".") + 1
+        end = token.find(".", start)
+        if start == 0 or end < 0:
+            raise ValueError("JWT is malformed")
+        payload = token[start:end]
+        claims = Utils.json_loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        if not isinstance(claims, dict):
+            raise ValueError("JWT payload is not a JSON object")
+        return claims
+
     @staticmethod
     def decode_token(*, cm_host: str, token: str) -> dict:
-        t = datetime.strptime("00:10:00", "%H:%M:%S")
-        jwt_validator = JWTValidator(url=f"https://{cm_host}/credmgr/certs",
-                                     refresh_period=timedelta(hours=t.hour, minutes=t.minute, seconds=t.second))
-        code, token_or_exception = jwt_validator.validate_jwt(token=token, verify_exp=True)
+        """
+        Validate a token against the signing keys of the credential manager and return its claims
+        The validator, and with it the fetched signing keys, is shared per credential manager host so the keys are
+        fetched once per JWKS_REFRESH_PERIOD rather than on every call. A token signed with a key that is not known
+        yet, e.g. after key rotation, triggers an early refetch at most once per JWKS_REFETCH_INTERVAL
+        @param cm_host credential manager host
+        @param token token to validate
+        @return decoded claims
+        @raises Exception if the token cannot be validated
+        """
+        with _jwt_validators_lock:
+            entry = _jwt_validators.get(cm_host)
+            if entry is None:
+                jwt_validator = JWTValidator(url=f"https://{cm_host}/credmgr/certs",
+                                             refresh_period=Utils.JWKS_REFRESH_PERIOD)
+                entry = _jwt_validators[cm_host] = [jwt_validator, None, threading.Lock()]
+        jwt_validator = entry[0]
+        # JWTValidator replaces its key dict in place while refreshing, so validations for a host are serialized; this
+        # also coalesces concurrent refetches into one. A slow host does not hold up validations for other hosts.
+        with entry[2]:
+            code, token_or_exception = jwt_validator.validate_jwt(token=token, verify_exp=True)
+            if code is ValidateCode.UNKNOWN_KEY and \
+                    (entry[1] is None or time.monotonic() - entry[1] >= Utils.JWKS_REFETCH_INTERVAL):
+                entry[1] = time.monotonic()
+                # The cached keys are only replaced by a successful fetch; if the refetch fails (including a response
+                # whose keys cannot be decoded, which clears the key dict), keep using them until they are due rather
+                # than fetching again on every validation
+                pub_keys, keys_fetched = jwt_validator.pubKeys, jwt_validator.keysFetched
+                jwt_validator.keysFetched = None
+                try:
+                    code, token_or_exception = jwt_validator.validate_jwt(token=token, verify_exp=True)
+                except Exception:
+                    jwt_validator.pubKeys, jwt_validator.keysFetched = pub_keys, keys_fetched
+                    raise
+                if code in (ValidateCode.UNABLE_TO_FETCH_KEYS, ValidateCode.UNABLE_TO_DECODE_KEYS):
+                    jwt_validator.pubKeys, jwt_validator.keysFetched = pub_keys, keys_fetched
         if code is not ValidateCode.VALID:
             raise Exception(f"Unable to validate provided token: {code}/{token_or_exception}")
         return token_or_exception
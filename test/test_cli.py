@@ -23,9 +23,16 @@
 #
 #
 # Author: Erica Fu (ericafu@renci.org), Komal Thareja (kthare10@renci.org)
+import json
+import time
+from unittest import mock
+
+import jwt
 from click.testing import CliRunner
+from fabric_cm.credmgr.credmgr_proxy import Status as CmStatus
 
 from fabrictestbed.cli import cli
+from fabrictestbed.slice_manager import CredmgrProxy
 
 
 def test_token_refresh():
@@ -35,6 +42,27 @@ def test_token_refresh():
     assert result.exit_code != 0
 
 
+def test_token_refresh_refreshes_fresh_token(tmp_path):
+    now = int(time.time())
+    id_token = jwt.encode({"iat": now, "exp": now + 3600, "scope": "all",
+                           "projects": [{"uuid": "project", "name": "name"}]}, "secret" * 8, algorithm="HS256")
+    token_location = tmp_path / "tokens.json"
+    token_location.write_text(json.dumps({"id_token": id_token, "refresh_token": "refresh",
+                                          "created_at": time.strftime("%Y-%m-%d %H:%M:%S +0000", time.gmtime(now))}))
+    refreshed = {"id_token": "new-id-token", "refresh_token": "new-refresh-token"}
+
+    runner = CliRunner()
+    with mock.patch.object(CredmgrProxy, "refresh", return_value=(CmStatus.OK, refreshed)) as refresh:
+        result = runner.invoke(cli.cli, ['tokens', 'refresh', '--cmhost', 'cm.example', '--tokenlocation',
+                                         str(token_location), '--projectid', 'project'],
+                               env={'FABRIC_ORCHESTRATOR_HOST': 'orchestrator.example'})
+    assert result.exit_code == 0
+    refresh.assert_called_once()
+    assert refresh.call_args.kwargs["refresh_token"] == "refresh"
+    assert "ID Token: new-id-token" in result.output
+    assert "Refresh Token: new-refresh-token" in result.output
+
+
 def test_token_revoke():
     runner = CliRunner()
     result = runner.invoke(cli.cli, ['token', 'revoke', '--refreshtoken', 'https://cilogon.org/oauth2/refreshToken/4884e9b835260111384cf83c2617efbf/1604534366554'])
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 FABRIC Testbed
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Author: Komal Thareja (kthare10@renci.org)
+import http.server
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+from fabrictestbed.external_api import core_api
+from fabrictestbed.external_api.core_api import CoreApi, CoreApiError
+
+
+@pytest.fixture
+def session():
+    core_api._reset_session()
+    yield core_api._get_session()
+    core_api._reset_session()
+
+
+def test_session_shared_between_clients(session):
+    assert core_api._get_session() is session
+    adapter = session.get_adapter("https://core.example")
+    assert adapter.max_retries is core_api._RETRY_POLICY
+    assert adapter.max_retries.status_forcelist == [502, 503, 504]
+
+    response = mock.Mock(status_code=200, content=b'{"results": [{"uuid": "user"}]}')
+    with mock.patch.object(session, "get", return_value=response) as get:
+        assert CoreApi(core_api_host="core.example", token="first").get_user_id() == "user"
+        assert CoreApi(core_api_host="core.example", token="second").get_user_id() == "user"
+    assert [c.kwargs["headers"]["Authorization"] for c in get.call_args_list] == ["Bearer first", "Bearer second"]
+
+
+def test_error_response(session):
+    response = mock.Mock(status_code=500, content=b"failed")
+    with mock.patch.object(session, "get", return_value=response):
+        with pytest.raises(CoreApiError):
+            CoreApi(core_api_host="core.example", token="token").get_user_id()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_session_reset_in_forked_child(session):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        os.write(write_fd, b"1" if core_api._session is None and core_api._get_session() is not session else b"0")
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as stream:
+        assert stream.read() == b"1"
+    os.waitpid(pid, 0)
+    assert core_api._get_session() is session
+
+
+
+def test_session_keeps_no_cookies(session):
+    cookies = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            cookies.append(self.headers.get("Cookie"))
+            self.send_response(200)
+            self.send_header("Set-Cookie", "sessionid=user; Path=/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/whoami"
+        session.get(url)
+        session.get(url)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert cookies == [None, None]
+    assert len(session.cookies) == 0
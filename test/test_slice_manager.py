@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 FABRIC Testbed
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Author: Komal Thareja (kthare10@renci.org)
+import pickle
+import threading
+from unittest import mock
+
+import pytest
+from fabric_cf.orchestrator.swagger_client import Slice
+
+from fabrictestbed.slice_manager import Status, GraphFormat
+from fabrictestbed.slice_manager import slice_manager as _slice_manager_module
+from fabrictestbed.slice_manager.slice_manager import SliceManager, SliceManagerException, PoaOperation
+
+
+def __get_slice_manager() -> SliceManager:
+    slice_manager = SliceManager.__new__(SliceManager)
+    slice_manager.ensure_valid_token = mock.Mock(return_value="token")
+    slice_manager.oc_proxy = mock.Mock()
+    slice_manager._resources_cache = {}
+    slice_manager._resources_cache_lock = threading.Lock()
+    return slice_manager
+
+
+def test_delete_many():
+    slice_manager = __get_slice_manager()
+
+    def delete(*, token: str, slice_id: str):
+        assert token == "token"
+        if slice_id == "bad":
+            return Status.FAILURE, Exception("failed")
+        if slice_id == "raise":
+            raise Exception("raised")
+        return Status.OK, None
+
+    slice_manager.oc_proxy.delete.side_effect = delete
+    result = slice_manager.delete_many(slices=[mock.Mock(slice_id=s) for s in ("a", "bad", "c")])
+
+    assert [(r[0], r[1]) for r in result] == [("a", Status.OK), ("bad", Status.FAILURE), ("c", Status.OK)]
+    assert str(result[1][2]) == "failed"
+    assert slice_manager.delete_many(slices=[]) == []
+
+    result = slice_manager.delete_many(slices=[None, mock.Mock(slice_id="raise"), mock.Mock(slice_id="a")])
+    assert [(r[0], r[1]) for r in result] == [(None, Status.INVALID_ARGUMENTS), ("raise", Status.FAILURE),
+                                              ("a", Status.OK)]
+    assert isinstance(result[0][2], SliceManagerException) and isinstance(result[1][2], SliceManagerException)
+    assert None not in [c.kwargs["slice_id"] for c in slice_manager.oc_proxy.delete.call_args_list]
+
+
+def test_slivers_many():
+    slice_manager = __get_slice_manager()
+
+    def slivers(*, token: str, slice_id: str, as_self: bool):
+        assert token == "token"
+        if slice_id == "bad":
+            return Status.FAILURE, Exception("failed")
+        return Status.OK, [f"{slice_id}-sliver"]
+
+    slice_manager.oc_proxy.slivers.side_effect = slivers
+    slice_objects = [Slice(slice_id=s, graph_id="graph", name=s, state="StableOK", lease_end_time="end")
+                     for s in ("a", "bad", "c")]
+    result = slice_manager.slivers_many(slice_objects=slice_objects)
+
+    assert [r[0] for r in result] == [Status.OK, Status.FAILURE, Status.OK]
+    assert result[0][1] == ["a-sliver"] and result[2][1] == ["c-sliver"]
+    assert str(result[1][1]) == "failed"
+    assert slice_manager.slivers_many(slice_objects=[]) == []
+
+    result = slice_manager.slivers_many(slice_objects=[mock.Mock(slice_id="a")])
+    assert result[0][0] == Status.INVALID_ARGUMENTS
+
+
+def test_get_poas_many():
+    slice_manager = __get_slice_manager()
+
+    def get_poas(*, token: str, limit: int, offset: int, sliver_id: str, poa_id: str):
+        assert token == "token"
+        if "bad" in (sliver_id, poa_id):
+            return Status.FAILURE, Exception("failed")
+        if poa_id == "raise":
+            raise Exception("raised")
+        return Status.OK, [sliver_id or poa_id]
+
+    slice_manager.oc_proxy.get_poas.side_effect = get_poas
+    result = slice_manager.get_poas_many(sliver_ids=["s1", "bad"], poa_ids=["p1", "p2"])
+
+    assert [r[0] for r in result] == [Status.OK, Status.FAILURE, Status.OK, Status.OK]
+    assert [r[1] for r in result if r[0] == Status.OK] == [["s1"], ["p1"], ["p2"]]
+    assert str(result[1][1]) == "failed"
+    assert slice_manager.get_poas_many(poa_ids=["p2"]) == [(Status.OK, ["p2"])]
+
+    result = slice_manager.get_poas_many(sliver_ids=["s1"], poa_ids=["raise"])
+    assert result[0] == (Status.OK, ["s1"])
+    assert result[1][0] == Status.FAILURE and isinstance(result[1][1], SliceManagerException)
+    assert slice_manager.get_poas_many() == []
+    assert slice_manager.get_poas_many(sliver_ids=[], poa_ids=[]) == []
+
+
+def test_invalid_arguments():
+    slice_manager = __get_slice_manager()
+
+    status, error = slice_manager.create(slice_name=None, ssh_key="key", slice_graph="graph")
+    assert status == Status.INVALID_ARGUMENTS
+    assert str(error) == "Invalid arguments - slice_name or ssh key"
+
+    status, error = slice_manager.modify(slice_id="slice", topology="not a topology")
+    assert status == Status.INVALID_ARGUMENTS
+    assert str(error) == "Invalid arguments - topology"
+
+    status, error = slice_manager.slivers(slice_object=mock.Mock(slice_id="slice"))
+    assert status == Status.INVALID_ARGUMENTS
+    slice_manager.oc_proxy.assert_not_called()
+
+    slice_manager.oc_proxy.modify_accept.return_value = Status.OK, None
+    assert slice_manager.modify_accept(slice_id="slice") == (Status.OK, None)
+
+    with pytest.raises(TypeError):
+        slice_manager.modify_accept()
+
+
+def test_resources_cache_disabled_by_default():
+    slice_manager = __get_slice_manager()
+    slice_manager.oc_proxy.resources.return_value = Status.OK, object()
+
+    slice_manager.resources()
+    slice_manager.resources()
+    assert slice_manager.oc_proxy.resources.call_count == 2
+    assert slice_manager._resources_cache == {}
+
+
+def test_resources_cache():
+    slice_manager = __get_slice_manager()
+    slice_manager.RESOURCES_CACHE_TTL = 60
+    topology = object()
+    slice_manager.oc_proxy.resources.return_value = Status.OK, topology
+
+    assert slice_manager.resources() == (Status.OK, topology)
+    assert slice_manager.resources() == (Status.OK, topology)
+    assert slice_manager.oc_proxy.resources.call_count == 1
+
+    assert slice_manager.resources(includes=["RENC"]) == (Status.OK, topology)
+    assert slice_manager.resources(force_refresh=True) == (Status.OK, topology)
+    assert slice_manager.oc_proxy.resources.call_count == 3
+
+    assert slice_manager.resources(use_cache=False) == (Status.OK, topology)
+    assert slice_manager.oc_proxy.resources.call_count == 4
+    assert slice_manager.oc_proxy.resources.call_args.kwargs["force_refresh"] is False
+
+    slice_manager.clear_resources_cache()
+    assert slice_manager.resources() == (Status.OK, topology)
+    assert slice_manager.oc_proxy.resources.call_count == 5
+
+
+def test_slices_graph_format():
+    slice_manager = __get_slice_manager()
+    slice_manager.oc_proxy.slices.return_value = Status.OK, []
+
+    slice_manager.slices()
+    slice_manager.slices(graph_format=GraphFormat.JSON_NODELINK)
+    slice_manager.slices(graph_format="NONE")
+
+    formats = [c.kwargs["graph_format"] for c in slice_manager.oc_proxy.slices.call_args_list]
+    assert formats == [GraphFormat.GRAPHML.name, GraphFormat.JSON_NODELINK.name, "NONE"]
+
+
+def test_iter_slices():
+    slice_manager = __get_slice_manager()
+    pages = {0: [1, 2], 2: [3, 4], 4: [5]}
+    slice_manager.oc_proxy.slices.side_effect = lambda limit, offset, **kwargs: (Status.OK, pages[offset])
+
+    assert list(slice_manager.iter_slices(page_size=2)) == [1, 2, 3, 4, 5]
+    assert slice_manager.oc_proxy.slices.call_count == 3
+
+    slice_manager.oc_proxy.get_poas.return_value = Status.FAILURE, Exception("failed")
+    with pytest.raises(SliceManagerException):
+        list(slice_manager.iter_poas(sliver_id="sliver"))
+
+
+def test_close_releases_shared_pool(tmp_path):
+    oc_host = "orchestrator.example"
+    kwargs = dict(oc_host=oc_host, cm_host="cm.example", token_location=str(tmp_path / "tokens.json"),
+                  project_id="project", initialize=False)
+    first = SliceManager(**kwargs)
+    with SliceManager(**kwargs) as second:
+        pool_manager = second.oc_proxy.slices_api.api_client.rest_client.pool_manager
+        assert first.oc_proxy.slices_api.api_client.rest_client.pool_manager is pool_manager
+
+    with mock.patch.object(pool_manager, "clear") as clear:
+        first.close()
+        first.close()
+        clear.assert_called_once_with()
+
+
+def test_poa_operation():
+    slice_manager = __get_slice_manager()
+    slice_manager.oc_proxy.poa.return_value = Status.OK, []
+
+    assert slice_manager.poa(sliver_id="sliver", operation=PoaOperation.REBOOT) == (Status.OK, [])
+    assert slice_manager.poa(sliver_id="sliver", operation="cpuinfo") == (Status.OK, [])
+    assert [c.kwargs["operation"] for c in slice_manager.oc_proxy.poa.call_args_list] == ["reboot", "cpuinfo"]
+
+    status, error = slice_manager.poa(sliver_id="sliver", operation="shutdown")
+    assert status == Status.INVALID_ARGUMENTS
+    assert str(error) == "Invalid arguments - operation: shutdown"
+
+
+def test_pickle(tmp_path):
+    slice_manager = SliceManager(oc_host="orchestrator.example", cm_host="cm.example", project_id="project",
+                                 token_location=str(tmp_path / "tokens.json"), initialize=False)
+    with pickle.loads(pickle.dumps(slice_manager)) as restored:
+        assert restored.oc_proxy is not slice_manager.oc_proxy
+        assert restored.oc_proxy.slices_api.api_client.rest_client.pool_manager is \
+               slice_manager.oc_proxy.slices_api.api_client.rest_client.pool_manager
+    slice_manager.close()
+
+
+@pytest.mark.parametrize("max_connections", [1, 1000])
+def test_pool_never_shrunk(max_connections):
+    oc_host = f"pool-{max_connections}.example"
+    oc_proxy = _slice_manager_module._create_orchestrator_proxy(oc_host=oc_host, max_connections=max_connections)
+    try:
+        default = oc_proxy.slices_api.api_client.configuration.connection_pool_maxsize
+        pool_kw = oc_proxy.slices_api.api_client.rest_client.pool_manager.connection_pool_kw
+        assert pool_kw["maxsize"] == max(default, max_connections)
+    finally:
+        _slice_manager_module._release_orchestrator_proxy(oc_host=oc_host, oc_proxy=oc_proxy)
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 FABRIC Testbed
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Author: Komal Thareja (kthare10@renci.org)
+import gc
+import json
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import jwt
+import pytest
+
+from fabrictestbed.token_manager import token_manager as _token_manager_module
+from fabrictestbed.token_manager.token_manager import TokenManager
+from fabrictestbed.util.utils import Utils
+
+
+def __get_token_manager(tmp_path, *, issued_at: float, expires_at: float, auto_refresh: bool = False,
+                        **claims) -> TokenManager:
+    id_token = jwt.encode({"iat": int(issued_at), "exp": int(expires_at), **claims}, "secret" * 8, algorithm="HS256")
+    token_location = tmp_path / "tokens.json"
+    token_location.write_text(json.dumps({"id_token": id_token, "refresh_token": "refresh",
+                                          "created_at": time.strftime("%Y-%m-%d %H:%M:%S +0000",
+                                                                      time.gmtime(issued_at))}))
+    return TokenManager(cm_host="cm.example", token_location=str(token_location), project_id="project",
+                        auto_refresh=auto_refresh)
+
+
+def test_ensure_valid_token_skips_renew_check_for_fresh_token(tmp_path):
+    now = time.time()
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    with mock.patch.object(token_manager, "_should_renew") as should_renew:
+        assert token_manager.ensure_valid_token() == token_manager.get_id_token()
+        should_renew.assert_not_called()
+
+
+def test_ensure_valid_token_checks_renewal_near_expiry(tmp_path):
+    now = time.time()
+    token_manager = __get_token_manager(tmp_path, issued_at=now - 3500, expires_at=now + 100)
+    with mock.patch.object(token_manager, "_should_renew", return_value=False) as should_renew:
+        assert token_manager.ensure_valid_token() == token_manager.get_id_token()
+        should_renew.assert_called_once()
+
+
+def test_id_token_claims_cached(tmp_path):
+    now = int(time.time())
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    other_token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    claims = {"uuid": "user", "email": "user@example.com", "projects": [{"uuid": "project", "name": "name"}],
+              "exp": now + 3600}
+
+    with mock.patch.object(Utils, "decode_token", return_value=claims) as decode_token:
+        assert token_manager.get_user_id() == "user"
+        token_manager.user_id = None
+        assert token_manager.get_user_id() == "user"
+        assert other_token_manager.get_user_email() == "user@example.com"
+        assert other_token_manager.get_user_id_and_email() == ("user", "user@example.com")
+        assert decode_token.call_count == 1
+
+
+def test_ensure_valid_token_renews_once_for_concurrent_callers(tmp_path):
+    now = time.time()
+    token_manager = __get_token_manager(tmp_path, issued_at=now - 3500, expires_at=now + 100)
+    fresh_token = jwt.encode({"iat": int(now), "exp": int(now) + 3600}, "secret" * 8, algorithm="HS256")
+
+    def load_tokens(**kwargs):
+        time.sleep(0.1)
+        token_manager.tokens = {"id_token": fresh_token}
+
+    with mock.patch.object(token_manager, "_should_renew", return_value=True), \
+            mock.patch.object(token_manager, "_load_tokens", side_effect=load_tokens) as load:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: token_manager.ensure_valid_token(), range(4)))
+    assert results == [fresh_token] * 4
+    assert load.call_count == 1
+
+
+def test_should_renew_parses_created_at_once(tmp_path):
+    now = time.time()
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    with mock.patch.object(Utils, "parse_time", wraps=Utils.parse_time) as parse_time:
+        assert not token_manager._should_renew()
+        assert not token_manager._should_renew()
+        assert parse_time.call_count == 1
+    assert token_manager._created_at[1] == int(now)
+
+    token_manager.tokens = dict(token_manager.tokens, created_at="garbled")
+    with mock.patch.object(Utils, "parse_time", wraps=Utils.parse_time) as parse_time:
+        assert not token_manager._should_renew()
+        assert not token_manager._should_renew()
+        assert parse_time.call_count == 1
+    assert token_manager._created_at[1] == int(now)
+
+
+def test_cm_proxy_created_on_first_use(tmp_path):
+    now = time.time()
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    assert token_manager.ensure_valid_token() is not None
+    assert token_manager._cm_proxy is None
+    assert token_manager.cm_proxy.host == "cm.example"
+    assert token_manager.cm_proxy is token_manager.cm_proxy
+
+
+def test_token_file_reread_once_when_partially_written(tmp_path):
+    now = time.time()
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    token_location = tmp_path / "tokens.json"
+    tokens = token_location.read_text()
+    token_location.write_text(tokens[:10])
+
+    def sleep(_):
+        token_location.write_text(tokens)
+
+    with mock.patch("fabrictestbed.token_manager.token_manager.time.sleep", side_effect=sleep):
+        assert token_manager._read_token_file() == json.loads(tokens)
+
+
+def test_ensure_valid_token_skips_refresh_when_file_already_renewed(tmp_path):
+    now = time.time()
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    token_manager.auto_refresh = True
+    token_manager.tokens = dict(token_manager.tokens, created_at="2000-01-01 00:00:00 +0000")
+    token_manager._id_token_times = (token_manager.get_id_token(), None, None, 0)
+
+    with mock.patch.object(token_manager, "refresh_tokens") as refresh_tokens:
+        assert token_manager.ensure_valid_token() == token_manager.get_id_token()
+        refresh_tokens.assert_not_called()
+
+
+def test_pickle_carries_id_token_claims(tmp_path):
+    now = int(time.time())
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    claims = {"uuid": "user", "email": "user@example.com", "exp": now + 3600}
+    with mock.patch.object(Utils, "decode_token", return_value=claims):
+        token_manager.get_user_id()
+    pickled = pickle.dumps(token_manager)
+
+    # Simulate a fresh worker process with an empty claims cache
+    with mock.patch.object(_token_manager_module, "_id_token_claims", {}), \
+            mock.patch.object(Utils, "decode_token") as decode_token:
+        restored = pickle.loads(pickled)
+        restored.user_id = None
+        assert restored.get_user_id() == "user"
+        decode_token.assert_not_called()
+    assert restored.ensure_valid_token() == token_manager.get_id_token()
+
+
+def test_id_token_times(tmp_path):
+    now = int(time.time())
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    with mock.patch.object(Utils, "get_unverified_claims", wraps=Utils.get_unverified_claims) as get_claims:
+        assert token_manager.id_token_issued_at().timestamp() == now
+        assert token_manager.id_token_expires_at().timestamp() == now + 3600
+        token_manager.ensure_valid_token()
+        assert get_claims.call_count == 1
+
+    token_manager.tokens = {"id_token": "not-a-jwt"}
+    assert token_manager.id_token_expires_at() is None
+
+    token_manager.tokens = {}
+    assert token_manager.id_token_expires_at() is None
+
+
+def test_id_token_times_with_malformed_claims(tmp_path):
+    now = int(time.time())
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    token_manager.tokens = {"id_token": jwt.encode({"iat": "x", "exp": now + 3600}, "secret" * 8, algorithm="HS256")}
+    with mock.patch.object(token_manager, "_should_renew", return_value=False):
+        assert token_manager.ensure_valid_token() == token_manager.get_id_token()
+    assert token_manager.id_token_issued_at() is None
+    assert token_manager.id_token_expires_at() is None
+
+
+@pytest.mark.parametrize("projects, refreshed", [([{"uuid": "project", "name": "name"}], False),
+                                                  ([{"uuid": "other", "name": "name"}], True)])
+def test_initialize_refreshes_only_for_other_project(tmp_path, projects, refreshed):
+    now = time.time()
+    with mock.patch.object(TokenManager, "refresh_tokens") as refresh_tokens:
+        token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600, auto_refresh=True,
+                                            projects=projects)
+        token_manager.close()
+    assert refresh_tokens.called == refreshed
+
+
+def test_refresh_rereads_user_info_from_token(tmp_path):
+    now = int(time.time())
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    token_manager.cm_proxy = mock.Mock()
+    token_manager.cm_proxy.refresh.return_value = _token_manager_module.CmStatus.OK, token_manager.tokens
+    claims = {"uuid": "user", "email": "user@example.com", "exp": now + 3600}
+
+    with mock.patch.object(Utils, "decode_token", return_value=claims):
+        assert token_manager.get_user_id() == "user"
+    token_manager.refresh_tokens(refresh_token="refresh")
+    assert token_manager.user_id is None and token_manager.project_id == "project"
+
+    token_manager.user_id = "explicit"
+    token_manager.refresh_tokens(refresh_token="refresh")
+    assert token_manager.user_id == "explicit"
+
+
+def test_refresh_tokens_deduplicated(tmp_path):
+    now = int(time.time())
+    token_manager = __get_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    token_manager.cm_proxy = mock.Mock()
+    tokens = dict(token_manager.tokens, refresh_token="rotated")
+    token_manager.cm_proxy.refresh.return_value = _token_manager_module.CmStatus.OK, tokens
+
+    assert token_manager.refresh_tokens(refresh_token="refresh") == (tokens["id_token"], "rotated")
+    assert token_manager.refresh_tokens(refresh_token="refresh") == (tokens["id_token"], "rotated")
+    assert token_manager.refresh_tokens(refresh_token="rotated") == (tokens["id_token"], "rotated")
+    assert token_manager.cm_proxy.refresh.call_count == 1
+
+    token_manager.refresh_tokens(refresh_token="other")
+    assert token_manager.cm_proxy.refresh.call_count == 2
+
+    for attribute, value in (("project_id", "other"), ("project_name", "other"), ("scope", "cf")):
+        setattr(token_manager, attribute, value)
+        token_manager.refresh_tokens(refresh_token="rotated")
+        assert token_manager.cm_proxy.refresh.call_args.kwargs[attribute] == value
+    assert token_manager.cm_proxy.refresh.call_count == 5
+
+
+def test_decode_token_reuses_validator_per_host():
+    from fabrictestbed.util import utils as _utils_module
+
+    with mock.patch.object(_utils_module, "JWTValidator") as validator_class, \
+            mock.patch.dict(_utils_module._jwt_validators, clear=True):
+        validator_class.return_value.validate_jwt.return_value = _utils_module.ValidateCode.VALID, {"uuid": "user"}
+        assert Utils.decode_token(cm_host="cm.example", token="token") == {"uuid": "user"}
+        assert Utils.decode_token(cm_host="cm.example", token="other") == {"uuid": "user"}
+        assert validator_class.call_count == 1
+        Utils.decode_token(cm_host="other.example", token="token")
+        assert validator_class.call_count == 2
+
+
+def test_decode_token_refetches_keys_for_unknown_key_once():
+    from fabrictestbed.util import utils as _utils_module
+
+    with mock.patch.object(_utils_module, "JWTValidator") as validator_class, \
+            mock.patch.dict(_utils_module._jwt_validators, clear=True):
+        validate_jwt = validator_class.return_value.validate_jwt
+        validate_jwt.return_value = _utils_module.ValidateCode.UNKNOWN_KEY, None
+        for _ in range(3):
+            with pytest.raises(Exception):
+                Utils.decode_token(cm_host="cm.example", token="token")
+        assert validate_jwt.call_count == 4
+
+
+def test_decode_token_slow_host_does_not_block_other_hosts():
+    from fabrictestbed.util import utils as _utils_module
+
+    started, release = threading.Event(), threading.Event()
+
+    def validate_slowly(**kwargs):
+        started.set()
+        release.wait(5)
+        return _utils_module.ValidateCode.VALID, {"uuid": "slow"}
+
+    def create_validator(url, **kwargs):
+        validator = mock.Mock()
+        if "slow.example" in url:
+            validator.validate_jwt.side_effect = validate_slowly
+        else:
+            validator.validate_jwt.return_value = _utils_module.ValidateCode.VALID, {"uuid": "user"}
+        return validator
+
+    with mock.patch.object(_utils_module, "JWTValidator", side_effect=create_validator), \
+            mock.patch.dict(_utils_module._jwt_validators, clear=True), ThreadPoolExecutor(max_workers=1) as executor:
+        slow = executor.submit(Utils.decode_token, cm_host="slow.example", token="token")
+        try:
+            assert started.wait(5)
+            assert Utils.decode_token(cm_host="cm.example", token="token") == {"uuid": "user"}
+            assert not slow.done()
+        finally:
+            release.set()
+        assert slow.result() == {"uuid": "slow"}
+
+
+def test_decode_token_keeps_cached_keys_when_refetch_fails():
+    from fabrictestbed.util import utils as _utils_module
+
+    with mock.patch.object(_utils_module, "JWTValidator") as validator_class, \
+            mock.patch.dict(_utils_module._jwt_validators, clear=True):
+        validator = validator_class.return_value
+        validator.keysFetched = fetched = object()
+        validator.validate_jwt.side_effect = [(_utils_module.ValidateCode.UNKNOWN_KEY, None),
+                                              (_utils_module.ValidateCode.UNABLE_TO_FETCH_KEYS, None)]
+        with pytest.raises(Exception):
+            Utils.decode_token(cm_host="cm.example", token="token")
+        assert validator.keysFetched is fetched
+
+        validator.validate_jwt.side_effect = [(_utils_module.ValidateCode.UNKNOWN_KEY, None), ConnectionError()]
+        _utils_module._jwt_validators["cm.example"][1] = None
+        with pytest.raises(ConnectionError):
+            Utils.decode_token(cm_host="cm.example", token="token")
+        assert validator.keysFetched is fetched
+
+        # Like JWTValidator.fetch_pub_keys, clear the keys and mark them fetched before failing to decode them
+        def validate_jwt(**_):
+            if validator.keysFetched is not None:
+                return _utils_module.ValidateCode.UNKNOWN_KEY, None
+            validator.pubKeys, validator.keysFetched = {}, object()
+            return _utils_module.ValidateCode.UNABLE_TO_DECODE_KEYS, None
+
+        validator.pubKeys = pub_keys = {"kid": "key"}
+        validator.validate_jwt.side_effect = validate_jwt
+        _utils_module._jwt_validators["cm.example"][1] = None
+        with pytest.raises(Exception):
+            Utils.decode_token(cm_host="cm.example", token="token")
+        assert validator.pubKeys is pub_keys
+        assert validator.keysFetched is fetched
+
+
+def __get_refreshing_token_manager(tmp_path, *, issued_at: float, expires_at: float) -> TokenManager:
+    return __get_token_manager(tmp_path, issued_at=issued_at, expires_at=expires_at, auto_refresh=True, scope="all",
+                               projects=[{"uuid": "project", "name": "name"}])
+
+
+def test_refresh_timer_delay_offset_per_instance(tmp_path):
+    now = int(time.time())
+    token_manager = __get_refreshing_token_manager(tmp_path, issued_at=now, expires_at=now + 4000)
+    offset = token_manager._refresh_timer_offset
+    assert 0 <= offset < TokenManager.REFRESH_TIMER_JITTER
+
+    with mock.patch.object(_token_manager_module.threading, "Timer") as timer_class:
+        token_manager.start_refresh_timer()
+        delay = timer_class.call_args.args[0]
+        assert delay == pytest.approx(now + 3000 - time.time() + offset, abs=2)
+
+        token_manager.start_refresh_timer(delay=0)
+        assert timer_class.call_args.args[0] == TokenManager.REFRESH_RETRY_INTERVAL + offset
+        timer_class.return_value.cancel.assert_called_once_with()
+        token_manager.close()
+        assert timer_class.return_value.cancel.call_count == 2
+
+
+def test_refresh_in_background_renews_only_if_due_and_rearms(tmp_path):
+    now = int(time.time())
+    with mock.patch.object(TokenManager, "refresh_tokens"):
+        token_manager = __get_refreshing_token_manager(tmp_path, issued_at=now - 3500, expires_at=now + 100)
+
+    with mock.patch.object(token_manager, "_load_tokens") as load_tokens, \
+            mock.patch.object(token_manager, "start_refresh_timer") as start_refresh_timer:
+        token_manager._refresh_in_background()
+        load_tokens.assert_called_once_with(only_if_due=True)
+        start_refresh_timer.assert_called_once_with()
+
+        load_tokens.side_effect = Exception("failed")
+        token_manager._refresh_in_background()
+        assert start_refresh_timer.call_count == 2
+
+
+def test_refresh_in_background_skips_fresh_token(tmp_path):
+    now = int(time.time())
+    token_manager = __get_refreshing_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    with mock.patch.object(token_manager, "_load_tokens") as load_tokens:
+        token_manager._refresh_in_background()
+        load_tokens.assert_not_called()
+    timer, _ = token_manager._refresh_timer
+    token_manager.close()
+    assert timer.finished.is_set()
+    assert token_manager._refresh_timer is None
+
+
+def test_refresh_timer_cancelled_when_collected(tmp_path):
+    now = int(time.time())
+    token_manager = __get_refreshing_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    token_manager.start_refresh_timer()
+    timer, _ = token_manager._refresh_timer
+    assert not timer.finished.is_set()
+
+    del token_manager
+    gc.collect()
+    assert timer.finished.is_set()
+
+
+def test_close_during_background_refresh_stops_timer(tmp_path):
+    now = int(time.time())
+    with mock.patch.object(TokenManager, "refresh_tokens"):
+        token_manager = __get_refreshing_token_manager(tmp_path, issued_at=now - 3500, expires_at=now + 100)
+    started, release = threading.Event(), threading.Event()
+
+    def load_tokens(**kwargs):
+        started.set()
+        release.wait(5)
+
+    with mock.patch.object(token_manager, "_load_tokens", side_effect=load_tokens), \
+            ThreadPoolExecutor(max_workers=2) as executor:
+        refresh = executor.submit(token_manager._refresh_in_background)
+        assert started.wait(5)
+        close = executor.submit(token_manager.close)
+        release.set()
+        refresh.result()
+        close.result()
+
+    assert token_manager._refresh_timer is None
+    token_manager.start_refresh_timer()
+    assert token_manager._refresh_timer is None
+
+
+def test_close_before_background_refresh_rearms(tmp_path):
+    now = int(time.time())
+    token_manager = __get_refreshing_token_manager(tmp_path, issued_at=now, expires_at=now + 3600)
+    start_refresh_timer = token_manager.start_refresh_timer
+
+    def close_then_rearm(**kwargs):
+        token_manager.close()
+        start_refresh_timer(**kwargs)
+
+    with mock.patch.object(token_manager, "start_refresh_timer", side_effect=close_then_rearm):
+        token_manager._refresh_in_background()
+    assert token_manager._refresh_timer is None